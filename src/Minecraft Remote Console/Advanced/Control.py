@@ -1,11 +1,17 @@
 #!/usr/bin/python
+from collections import deque, OrderedDict
 from os import path
 import pickle
+from threading import Lock, local
+from time import time
 
 import wx
 
 from Window import AdvancedWindow
 from Common.Commands import CommandCategory
+from Common.EventBus import EventBus
+from Common.Metrics import Metrics
+from Common.Rendering import OutputCoalescer, Scrollback
 from Common import Events
 
 def noop(*args, **kwargs):
@@ -14,15 +20,31 @@ def noop(*args, **kwargs):
 class Control (object):
     ENVIRON_STORE = '__environ_store'
     STORES_PATH = path.expanduser('~/.MinecraftRemoteConsole.store')
-    def __init__(self, window):
+    HISTORY_PATH = path.expanduser('~/.MinecraftRemoteConsole.history')
+    DEPTH_FIRST = 'depth'
+    BREADTH_FIRST = 'breadth'
+    def __init__(self, window, chain_order=DEPTH_FIRST, max_chain_length=500,
+            scrollback_lines=10000, scrollback_bytes=None, history=True,
+            queue_sizes=None, queue_policies=None):
         self.__window = window
         window.Bind(wx.EVT_CLOSE, self.__evt_close_window)
         window._entry.Bind(wx.EVT_CHAR, self.__evt_entry_char)
         window._action.Bind(wx.EVT_BUTTON, self.__evt_action_click)
-        self.__command_categories = {}
+        self.__command_categories = OrderedDict()
+        self.__dispatch = None
+        self.__dispatch_lock = Lock()
         self.__default_handler = noop
         self.__stores = {}
         self.__quitting = False
+        self.chain_order = chain_order
+        self.max_chain_length = max_chain_length
+        self.__chains = local()
+        self.__chain_metrics = Metrics()
+        self.__scrollback = Scrollback(scrollback_lines, scrollback_bytes,
+            history_path=self.HISTORY_PATH if history else None)
+        self.__output = OutputCoalescer(self.__schedule, self.__flush_output)
+        self.__bus = EventBus(self.__run_chain, queue_sizes, queue_policies,
+                              on_error=self.__evt_handler_error)
         try:
             self.load()
         except Exception as e:
@@ -52,60 +74,196 @@ class Control (object):
         else:
             self.quit_app()
     
-    def __update_after_event(self, event):
+    def __evt_handler_error(self, event, error):
+        '''Shows errors from handling events posted without waiting.
+        '''
+        self.__output.add(['ERROR', 'Error handling %s event: %s' %
+                           (event.event_type, error)])
+
+    def __schedule(self, delay, callback):
+        if delay > 0:
+            wx.CallAfter(wx.CallLater, int(delay * 1000), callback)
+        else:
+            wx.CallAfter(callback)
+
+    def __flush_output(self, text, input, scroll):
+        '''Display a batch of output with a single append.
+
+        Text beyond the scrollback limit is removed from the top.
+        '''
         self.__window.Freeze()
         try:
-            for line in event.get_output():
-                uline = unicode(line)
-                if uline[-1] != u'\n':
-                    uline += u'\n'
-                self.__window._output.AppendText(uline)
+            if text:
+                output = self.__window._output
+                output.AppendText(text)
+                trim = self.__scrollback.append(text,
+                                                output.GetLastPosition())
+                if trim:
+                    output.Remove(0, trim)
         finally:
-            if event.scroll_output:
+            if scroll:
                 self.__window._output.ShowPosition(
-                    self.__window._output.GetLastPosition)
+                    self.__window._output.GetLastPosition())
             self.__window.Thaw()
-        if event.set_input:
-            self.__window._entry.Value = event.input
+        if input is not None:
+            self.__window._entry.Value = input
             self.__window._entry.SetInsertionPointEnd()
   
+    def __invalidate_dispatch(self, category=None):
+        '''Drop the dispatch table, it is rebuilt on the next event.
+        '''
+        with self.__dispatch_lock:
+            self.__dispatch = None
+
+    def __dispatch_table(self):
+        '''Get the table of event type to the categories listening for it.
+
+        Categories are listed in the order they were registered.
+        '''
+        table = self.__dispatch
+        if table is None:
+            with self.__dispatch_lock:
+                table = {}
+                for category in self.__command_categories.values():
+                    for type_ in category.event_types():
+                        table.setdefault(type_, []).append(category)
+                table = dict([(k, tuple(v)) for k, v in table.items()])
+                self.__dispatch = table
+        return table
+
     def trigger_event(self, event):
-        '''Trigger an event and handle the results.
+        '''Trigger an event and wait until it has been handled.
+
+        Handlers always run on the event bus dispatcher. From any other
+        thread the event is queued ahead of pending output and waited for.
+        Events triggered from a handler are added to the running event
+        chain and handled once the handler returns.
+        '''
+        if not isinstance(event, Events.Event):
+            raise TypeError('event must be a subclass of Event')
+        if self.__bus.is_dispatcher():
+            self.__run_chain(event)
+        else:
+            self.__bus.post(event, EventBus.INTERACTIVE, wait=True)
+
+    def post_event(self, event):
+        '''Queue an event to be handled without waiting for it.
+
+        For producers such as network readers. Output may be dropped when
+        the queue is full, see get_event_stats, and every event is dropped
+        once the application is quitting.
         '''
-        event.env = self.get_datastore(Control.ENVIRON_STORE)
         if not isinstance(event, Events.Event):
             raise TypeError('event must be a subclass of Event')
-        for category in self.__command_categories.values():
-            if not event.stop_execution:
-                category.invoke(event)
+        self.__bus.post(event)
+
+    def get_event_stats(self):
+        '''Get queue statistics for every lane of the event bus.'''
+        return self.__bus.stats()
+
+    def get_scrollback(self):
+        '''Get the Scrollback recording what the output pane holds.
+
+        Its history_path names the file holding the full output history.
+        '''
+        return self.__scrollback
+
+    def get_chain_metrics(self):
+        '''Get timing of event chains, keyed by the type of their first event.
+
+        Only chains of more than one event are recorded.
+        '''
+        return self.__chain_metrics
+
+    def __run_chain(self, event):
+        '''Handle an event and every event it triggers.
+
+        Triggered events are taken from a work queue, depth or breadth
+        first as set by chain_order, rather than by recursion. Events
+        triggered directly from a handler join the work queue of the chain
+        already running. A chain is stopped once it has handled
+        max_chain_length events.
+        '''
+        chain = getattr(self.__chains, 'current', None)
+        if chain is not None:
+            chain['work'].append(event)
+            return
+        work = deque([event])
+        chain = self.__chains.current = {'events': 0, 'work': work}
+        started = time()
+        try:
+            while work:
+                if chain['events'] >= self.max_chain_length:
+                    self.__chain_metrics.count('chains stopped')
+                    self.__output.add(['Event chain stopped after %d events'
+                                       % chain['events']])
+                    break
+                if self.chain_order == self.BREADTH_FIRST:
+                    evt = work.popleft()
+                else:
+                    evt = work.pop()
+                chain['events'] += 1
+                self.__process_event(evt)
+                if evt.is_canceled:
+                    continue
+                triggered = evt.get_triggered_events()
+                if self.chain_order == self.BREADTH_FIRST:
+                    work.extend(triggered)
+                else:
+                    work.extend(reversed(triggered))
+        finally:
+            self.__chains.current = None
+            # Single events, such as every console line, are not recorded
+            # so the feed path stays free of locking
+            if chain['events'] > 1:
+                self.__chain_metrics.record(event.event_type, 'chain',
+                                            time() - started)
+                self.__chain_metrics.count('%s chain events' %
+                                           event.event_type, chain['events'])
+
+    def __process_event(self, event):
+        '''Run an event through its handlers and display the results.
+
+        Triggered events are left to __run_chain.
+        '''
+        event.env = self.get_datastore(Control.ENVIRON_STORE)
+        for category in self.__dispatch_table().get(event.event_type, ()):
+            if event.stop_execution:
+                break
+            category.invoke(event)
         if not event.is_handled and not event.is_canceled:
             self.__default_handler(event)
         if not event.is_canceled:
-            wx.CallAfter(self.__update_after_event, event)
+            self.__output.add(event.get_output(),
+                              event.input if event.set_input else None,
+                              event.scroll_output)
             if callable(event.on_success):
                 wx.CallAfter(event.on_success)
-            for evt in event.get_triggered_events():
-                self.trigger_event(evt)
         if callable(event.after):
             wx.CallAfter(event.after)
  
     def quit_app(self):
-        def __quit():
-            self.__window.Close()
         evt = Events.QuitEvent('Quit App')
+        def __quit():
+            # Runs once the QuitEvent has been handled
+            self.__quitting = not evt.is_canceled
+            if not evt.is_canceled:
+                self.__bus.close()
+                self.__scrollback.close()
+                self.__window.Close()
+        evt.after = __quit
         self.trigger_event(evt)
-        self.__quitting = not evt.is_canceled
-        if not evt.is_canceled:
-            wx.CallAfter(__quit)
 
 
     def clear(self):
         '''Clear the output
         '''
+        self.__output.discard()
         def __clear():
             self.__window.Freeze()
             try:
                 self.__window._output.Value = ''
+                self.__scrollback.clear()
             finally:
                 self.__window.Thaw()
         wx.CallAfter(__clear)
@@ -133,7 +291,12 @@ class Control (object):
     def register_commands(self, category):
         if not isinstance(category, CommandCategory):
             raise TypeError('category must be a CommandCategory object')
+        old = self.__command_categories.get(category.prefix)
+        if old is not None:
+            old.unwatch(self.__invalidate_dispatch)
         self.__command_categories[category.prefix] = category
+        category.watch(self.__invalidate_dispatch)
+        self.__invalidate_dispatch()
         self.get_datastore(category.prefix)
         return True
         
@@ -151,6 +314,8 @@ class Control (object):
             raise KeyError(keyerror % prefix)
         cat = self.__command_categories[prefix]
         del self.__command_categories[prefix]
+        cat.unwatch(self.__invalidate_dispatch)
+        self.__invalidate_dispatch()
         return cat
 
     def get_datastore(self, category):
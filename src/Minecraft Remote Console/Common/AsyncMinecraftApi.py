@@ -0,0 +1,331 @@
+#!/usr/bin/python
+import asyncore
+import errno
+import json
+import socket
+import sys
+from threading import Thread
+from time import sleep, time
+
+from Common.MinecraftApi import (ConnectionPool, LineBuffer, MinecraftJsonApi,
+                                 decompress)
+from Common.Results import AsyncResult
+
+# errno values meaning the peer has gone away
+DISCONNECTED = frozenset([errno.ECONNRESET, errno.ENOTCONN, errno.ESHUTDOWN,
+                          errno.ECONNABORTED, errno.EPIPE, errno.EBADF])
+
+class AsyncConnection(asyncore.dispatcher):
+    '''
+    Non-blocking client socket driven by an asyncore socket map.
+
+    Writes outgoing data as the socket allows and hands every chunk of
+    received data to handle_data.
+    '''
+    def __init__(self, host, port, outgoing, socket_map):
+        asyncore.dispatcher.__init__(self, map=socket_map)
+        af, socktype, proto, canonname, sa = socket.getaddrinfo(host, port,
+            socket.AF_UNSPEC, socket.SOCK_STREAM, socket.IPPROTO_TCP)[0]
+        self.__outgoing = outgoing
+        self.create_socket(af, socktype)
+        self.connect(sa)
+
+    def handle_connect(self):
+        pass
+
+    def writable(self):
+        return not self.connected or len(self.__outgoing) > 0
+
+    def handle_write(self):
+        sent = self.send(self.__outgoing)
+        self.__outgoing = self.__outgoing[sent:]
+
+    def handle_read(self):
+        data = self.recv(8192)
+        if data:
+            self.handle_data(data)
+
+    def handle_data(self, data):
+        pass
+
+    def handle_error(self):
+        error = sys.exc_info()[1]
+        self.close()
+        self.handle_failure(error)
+
+    def handle_failure(self, error):
+        pass
+
+class AsyncHttpRequest(AsyncConnection):
+    '''
+    A single GET request, completing result with (status, body).
+    '''
+    template = ('GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n'
+                'Connection: close\r\n')
+
+    def __init__(self, host, port, path, result, socket_map,
+            compression=False):
+        self.__result = result
+        self.__incoming = []
+        request = self.template.format(path=path, host=host, port=port)
+        if compression:
+            request += ('Accept-Encoding: %s\r\n' % 
+                        ConnectionPool.ACCEPT_ENCODING)
+        request += '\r\n'
+        AsyncConnection.__init__(self, host, port, request.encode(),
+            socket_map)
+
+    def __dechunk(self, body):
+        chunks = []
+        while body:
+            size, sep, body = body.partition('\r\n')
+            size = int(size.split(';')[0], 16)
+            if size == 0:
+                break
+            chunks.append(body[:size])
+            body = body[size+2:]
+        return ''.join(chunks)
+
+    def handle_data(self, data):
+        self.__incoming.append(data)
+
+    def handle_close(self):
+        self.close()
+        if self.__result.done():
+            return
+        head, sep, body = ''.join(self.__incoming).partition('\r\n\r\n')
+        if not sep:
+            self.handle_failure(Exception('Connection closed by server'))
+            return
+        lines = head.split('\r\n')
+        status = int(lines[0].split(None, 2)[1])
+        headers = dict([(k.strip().lower(), v.strip()) for k, sep, v in
+                        [l.partition(':') for l in lines[1:]]])
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = self.__dechunk(body)
+        try:
+            body = decompress(body, headers.get('content-encoding'))
+        except Exception as e:
+            self.handle_failure(e)
+            return
+        self.__result.set_result((status, body))
+
+    def handle_failure(self, error):
+        self.__result.set_error(error)
+
+class AsyncSubscription(AsyncConnection):
+    '''
+    A subscription to a JSONAPI stream.
+
+    callback is called with every decoded message, on_close (if provided)
+    is called with the error, or None, once the stream ends and on_open
+    (if provided) once the first message arrives, so a server that
+    accepts the connection and drops it straight away is not reported as
+    open. If metrics is given, time spent decoding messages and in
+    callback is recorded against name.
+    '''
+    def __init__(self, host, port, path, callback, socket_map,
+            on_close=None, on_open=None, compressed=False, metrics=None,
+            name='stream'):
+        self.__callback = callback
+        self.__on_close = on_close
+        self.__on_open = on_open
+        self.__metrics = metrics
+        self.__name = name
+        self.__buffer = LineBuffer(detect_compression=compressed)
+        AsyncConnection.__init__(self, host, port, (path + '\n').encode(),
+            socket_map)
+
+    def transfer_stats(self):
+        '''
+        Get the bytes received from the socket and after decompression.
+        '''
+        return {
+            'bytes_received': self.__buffer.bytes_received,
+            'bytes_decoded': self.__buffer.bytes_decoded,
+        }
+
+    def handle_read(self):
+        # Receive straight into the line buffer rather than through recv
+        try:
+            count = self.__buffer.recv_from(self.socket)
+        except socket.error as e:
+            if e.args[0] in DISCONNECTED:
+                self.handle_close()
+                return
+            raise
+        if not count:
+            self.handle_close()
+            return
+        start = time()
+        messages = [json.loads(line) for line in self.__buffer.lines()
+                    if line.strip()]
+        decoded = time()
+        if messages:
+            on_open, self.__on_open = self.__on_open, None
+            if callable(on_open):
+                on_open()
+        for message in messages:
+            self.__callback(message)
+        if self.__metrics is not None and messages:
+            self.__metrics.record(self.__name, 'decode', decoded - start)
+            self.__metrics.record(self.__name, 'dispatch', time() - decoded)
+            self.__metrics.count('%s messages' % self.__name, len(messages))
+
+    def handle_close(self):
+        self.close()
+        self.handle_failure(None)
+
+    def handle_failure(self, error):
+        on_close, self.__on_close = self.__on_close, None
+        if callable(on_close):
+            on_close(error)
+
+class AsyncMinecraftJsonApi(MinecraftJsonApi):
+    '''
+    Event loop driven interface to JSONAPI.
+
+    Calls and stream subscriptions are non-blocking sockets sharing one
+    asyncore socket map, so a single thread can drive any number of
+    concurrent calls and subscriptions. Drive the loop with run(), or
+    start() a background thread to do it.
+
+    Method loading and URL signing are inherited from MinecraftJsonApi, and
+    the blocking call interface remains available.
+    '''
+    def __init__(self, *args, **kwargs):
+        self.__map = {}
+        self.__multiple_supported = None
+        self.__running = False
+        self.__thread = None
+        super(AsyncMinecraftJsonApi, self).__init__(*args, **kwargs)
+
+    def __request(self, path):
+        result = AsyncResult()
+        AsyncHttpRequest(self.host, self.port, path, result, self.__map,
+                         self.compression)
+        return result
+
+    def __decode(self, response):
+        status, body = response
+        return json.loads(body)
+
+    def call_async(self, method, *args):
+        '''
+        Make a remote call, returning an AsyncResult for its value.
+
+        Identical concurrent calls to read-only methods share one request
+        and one AsyncResult.
+        '''
+        def start():
+            response = self.__request(self._createURL(method, args))
+            return response.then(
+                lambda r: self._parseResult(self.__decode(r)))
+        started = time()
+        if self.flights is None or not self.isReadOnly(method):
+            result = start()
+        else:
+            result = self.flights.do_async((method, json.dumps(args)), start)
+        result.add_callback(lambda r: self.metrics.record(method, 'total',
+                                                          time() - started))
+        return result
+
+    def call_many_async(self, calls):
+        '''
+        Make several remote calls in one request.
+
+        Returns an AsyncResult for the list of results, with the same
+        semantics as MinecraftJsonApi.call_many. Falls back to issuing the
+        calls concurrently when call-multiple is not available.
+        '''
+        methods = [c[0] for c in calls]
+        args = [list(c[1]) for c in calls]
+        def individually():
+            return AsyncResult.gather([self.call_async(m, *a)
+                                       for m, a in zip(methods, args)])
+        if not calls or self.__multiple_supported is False:
+            return individually()
+
+        combined = AsyncResult()
+        def finish(response):
+            result = None
+            if response.error is None and response.value[0] != 404:
+                try:
+                    result = self.__decode(response.value)
+                except ValueError:
+                    pass
+            if response.error is not None:
+                combined.set_error(response.error)
+                return
+            if not isinstance(result, dict):
+                self.__multiple_supported = False
+            else:
+                self.__multiple_supported = True
+                entries = result.get('success')
+                if (result.get('result') == 'success' and
+                        isinstance(entries, list) and
+                        len(entries) == len(calls)):
+                    combined.set_result([self._parseEntry(e)
+                                         for e in entries])
+                    return
+            individually().add_callback(
+                lambda r: combined.set_result(r.value))
+        url = self._createMultipleURL(methods, args)
+        self.__request(url).add_callback(finish)
+        return combined
+
+    def subscribe_async(self, feed, callback, on_close=None):
+        '''
+        Subscribe to the remote stream.
+
+        callback is called on the event loop thread with each decoded
+        message. Return the subscription, close() it to unsubscribe.
+        '''
+        if feed not in ['console', 'chat', 'connections']:
+            raise NotImplementedError(
+                'Subscribing to feed \'%s\' is not supported.' % feed)
+        return AsyncSubscription(self.host, self.port + 1,
+            self._createStreamURL(feed), callback, self.__map, on_close,
+            compressed=self.stream_compression, metrics=self.metrics,
+            name='feed:%s' % feed)
+
+    def run(self, timeout=0.05, count=None):
+        '''
+        Run the event loop until no calls or subscriptions remain.
+        '''
+        asyncore.loop(timeout, map=self.__map, count=count)
+
+    def start(self, timeout=0.05):
+        '''
+        Run the event loop on a background thread until stop() is called.
+        '''
+        def loop():
+            while self.__running:
+                if self.__map:
+                    asyncore.loop(timeout, map=self.__map, count=1)
+                else:
+                    sleep(timeout)
+        if self.__thread is None:
+            self.__running = True
+            self.__thread = Thread(target=loop)
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def stop(self):
+        '''
+        Stop the background event loop thread.
+        '''
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__thread = None
+
+    def close(self):
+        '''
+        Stop the event loop and close all open calls and subscriptions.
+        '''
+        self.stop()
+        asyncore.close_all(map=self.__map)
+        super(AsyncMinecraftJsonApi, self).close()
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
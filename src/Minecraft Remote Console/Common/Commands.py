@@ -1,8 +1,10 @@
 #!/usr/bin/python
 import sys
 import csv
+from time import time
 
 from Common.Events import Event
+from Common.Profiling import profiler
 def trim_docstring(docstring):
     '''Trim whitespace from string according to python docstring conventions.
     '''
@@ -124,6 +126,16 @@ class Command (object):
         self.prefix=''
 
     def invoke(self, event):
+        if not profiler.enabled:
+            return self.__invoke(event)
+        start = time()
+        try:
+            self.__invoke(event)
+        finally:
+            profiler.record('command', self.prefix + self.name,
+                            event.event_type, time() - start)
+
+    def __invoke(self, event):
         inval ='Invalid parameter count. See `%shelp %s` for details.' 
         if event.event_type == Event.TYPE_INPUT:
             args = len(event.args)-1
@@ -161,6 +173,7 @@ class CommandCategory(object):
         self.name = name
         self.description = description
         self.__commands = {}
+        self.__watchers = []
         self.add_builtins()
 
     def __help(self, event):
@@ -201,6 +214,7 @@ class CommandCategory(object):
             if evt not in self.__commands.keys():
                 self.__commands[evt] = {}
             self.__commands[evt][command.name] = command
+        self.__changed()
 
     def clear_commands(self, event_types=[Event.TYPE_INPUT]):
         '''Clear all commands from category
@@ -208,6 +222,25 @@ class CommandCategory(object):
         This included the automatically added Help command'''
         for evt in event_types:
             self.__commands[evt] = {}
+        self.__changed()
+
+    def watch(self, callback):
+        '''Call callback(category) whenever commands are added or cleared
+        '''
+        self.__watchers.append(callback)
+
+    def unwatch(self, callback):
+        '''Stop calling callback when commands change'''
+        if callback in self.__watchers:
+            self.__watchers.remove(callback)
+
+    def __changed(self):
+        for callback in list(self.__watchers):
+            callback(self)
+
+    def event_types(self):
+        '''List the event types at least one command listens to'''
+        return [evt for evt, cmds in self.__commands.items() if cmds]
 
     def add_builtins(self):
         '''Add builtin commands to the command category'''
@@ -220,6 +253,16 @@ class CommandCategory(object):
     def invoke(self, event):
         '''Invoke the event for all registered listeners in this category.
         '''
+        if not profiler.enabled:
+            return self.__invoke(event)
+        start = time()
+        try:
+            self.__invoke(event)
+        finally:
+            profiler.record('category', self.name, event.event_type,
+                            time() - start)
+
+    def __invoke(self, event):
         def resolve_cmd(type_, name):
             evt = self.__commands.get(type_, {})
             return evt.get(name, None)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+from collections import deque
+from threading import Condition, Thread, current_thread
+from time import time
+
+from Common.Results import AsyncResult
+from Common.Events import Event
+
+class EventBus(object):
+    '''
+    Bounded, prioritised queue of events handled on dispatcher threads.
+
+    Events wait in one lane per priority, lower numbers first, so user
+    input is handled ahead of queued output. Each lane holds at most
+    max_sizes[lane] events; when it is full, post either drops the oldest
+    queued event (DROP_OLDEST) or blocks until there is room (BLOCK), as
+    set by policies[lane]. Posting from a dispatcher thread never blocks,
+    so handlers cannot deadlock the bus.
+
+    With a single worker, events of the same lane are handled in the order
+    they were posted. Errors from handling an event nobody waits for are
+    passed to on_error(event, error), if given.
+    '''
+    INTERACTIVE = 0
+    OUTPUT = 1
+    LANES = {INTERACTIVE: 'interactive', OUTPUT: 'output'}
+    DROP_OLDEST = 'drop_oldest'
+    BLOCK = 'block'
+    OUTPUT_TYPES = [
+        Event.TYPE_OUTPUT,
+        Event.TYPE_CHAT,
+        Event.TYPE_PLAYER_CONNECTION,
+        Event.TYPE_RECONNECT,
+    ]
+
+    def __init__(self, handler, max_sizes=None, policies=None, workers=1,
+            on_error=None):
+        self.handler = handler
+        self.on_error = on_error
+        self.max_sizes = {self.INTERACTIVE: 1000, self.OUTPUT: 10000}
+        self.max_sizes.update(max_sizes or {})
+        self.policies = {self.INTERACTIVE: self.BLOCK,
+                         self.OUTPUT: self.DROP_OLDEST}
+        self.policies.update(policies or {})
+        self.__lanes = dict([(p, deque()) for p in self.LANES])
+        self.__cond = Condition()
+        self.__running = True
+        self.__stats = dict([(p, {
+            'posted': 0,
+            'dispatched': 0,
+            'dropped': 0,
+            'blocked': 0,
+            'blocked_time': 0.0,
+            'max_depth': 0,
+        }) for p in self.LANES])
+        self.__workers = [Thread(target=self.__work) for i in xrange(workers)]
+        for worker in self.__workers:
+            worker.daemon = True
+            worker.start()
+
+    def priority(self, event):
+        '''Get the lane an event is posted to by default.'''
+        if event.event_type in self.OUTPUT_TYPES:
+            return self.OUTPUT
+        return self.INTERACTIVE
+
+    def is_dispatcher(self):
+        '''Check whether the current thread is one of the dispatchers.'''
+        return current_thread() in self.__workers
+
+    def __next(self):
+        for priority in sorted(self.__lanes.keys()):
+            if self.__lanes[priority]:
+                return self.__lanes[priority].popleft()
+        return None
+
+    def __work(self):
+        while True:
+            with self.__cond:
+                while self.__running and not any(self.__lanes.values()):
+                    self.__cond.wait()
+                if not self.__running:
+                    return
+                priority, event, result = self.__next()
+                self.__stats[priority]['dispatched'] += 1
+                # wake producers blocked on a full lane
+                self.__cond.notify_all()
+            try:
+                self.handler(event)
+            except Exception as e:
+                if result is not None:
+                    result.set_error(e)
+                elif callable(self.on_error):
+                    try:
+                        self.on_error(event, e)
+                    except Exception:
+                        pass
+                continue
+            if result is not None:
+                result.set_result(event)
+
+    def post(self, event, priority=None, wait=False):
+        '''
+        Queue an event to be handled.
+
+        With wait, block until the event has been handled and re-raise any
+        error from the handler. Return the event, or None if it was dropped
+        to make room for newer events. Once the bus is closed, waiting posts
+        raise an Exception and other posts are dropped.
+        '''
+        if priority is None:
+            priority = self.priority(event)
+        result = AsyncResult() if wait else None
+        dropped = None
+        with self.__cond:
+            if not self.__running:
+                if wait:
+                    raise Exception('Event bus is closed')
+                return None
+            lane = self.__lanes[priority]
+            stats = self.__stats[priority]
+            stats['posted'] += 1
+            if len(lane) >= self.max_sizes[priority]:
+                if self.policies[priority] == self.DROP_OLDEST:
+                    dropped = lane.popleft()
+                    stats['dropped'] += 1
+                elif not self.is_dispatcher():
+                    stats['blocked'] += 1
+                    started = time()
+                    while (self.__running and
+                            len(lane) >= self.max_sizes[priority]):
+                        self.__cond.wait()
+                    stats['blocked_time'] += time() - started
+                    if not self.__running:
+                        if wait:
+                            raise Exception('Event bus is closed')
+                        return None
+            lane.append((priority, event, result))
+            stats['max_depth'] = max(stats['max_depth'], len(lane))
+            self.__cond.notify_all()
+        if dropped is not None and dropped[2] is not None:
+            dropped[2].set_result(None)
+        if result is not None:
+            return result.wait()
+        return event
+
+    def stats(self):
+        '''
+        Get depth, throughput, drop and blocking statistics for every lane.
+        '''
+        with self.__cond:
+            lanes = {}
+            for priority, name in self.LANES.items():
+                stats = dict(self.__stats[priority])
+                stats['depth'] = len(self.__lanes[priority])
+                stats['max_size'] = self.max_sizes[priority]
+                stats['policy'] = self.policies[priority]
+                lanes[name] = stats
+            return lanes
+
+    def close(self):
+        '''
+        Stop dispatching and release everything waiting on the bus.
+        '''
+        with self.__cond:
+            self.__running = False
+            pending = []
+            for lane in self.__lanes.values():
+                pending.extend(lane)
+                lane.clear()
+            self.__cond.notify_all()
+        for priority, event, result in pending:
+            if result is not None:
+                result.set_error(Exception('Event bus closed'))
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
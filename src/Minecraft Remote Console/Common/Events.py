@@ -1,7 +1,33 @@
 #!/usr/bin/python
 import csv
 
+# Shared by every event that has no output or triggered events yet
+_EMPTY = ()
+
 class Event(object):
+    '''Base of all events passed to commands.
+
+    Events are slotted and only allocate their output, triggered event and
+    environment containers once something is written to them, so that a
+    plain line of console output stays small.
+    '''
+    __slots__ = (
+        'data',
+        'clear_input',
+        'is_canceled',
+        'is_handled',
+        'scroll_output',
+        'stop_execution',
+        'stop_propagation',
+        'on_success',
+        'after',
+        'set_input',
+        'input',
+        '__args',
+        '__env',
+        '__output',
+        '__triggered_events',
+    )
     TYPE_PREINPUT = 'PREINPUT'
     TYPE_INPUT = 'INPUT'
     TYPE_OUTPUT = 'OUTPUT'
@@ -12,6 +38,9 @@ class Event(object):
     TYPE_STARTUP = 'STARTUP'
     TYPE_REGISTER = 'REGISTER'
     TYPE_UNREGISTER = 'UNREGISTER'
+    TYPE_CHAT = 'CHAT'
+    TYPE_PLAYER_CONNECTION = 'PLAYERCONNECTION'
+    TYPE_RECONNECT = 'RECONNECT'
     TYPE_ANY = [
         TYPE_PREINPUT,
         TYPE_INPUT,
@@ -22,99 +51,163 @@ class Event(object):
         TYPE_UNREGISTER,
         TYPE_CONNECT,
         TYPE_DISCONNECT,
-        TYPE_KEYPRESS
+        TYPE_KEYPRESS,
+        TYPE_CHAT,
+        TYPE_PLAYER_CONNECTION,
+        TYPE_RECONNECT
     ]
     event_type = TYPE_ANY
     def __init__(self, data, on_success=None, after=None):
-        self.event_type = Event.TYPE_ANY
         self.data = data
         self.clear_input = False
-        _args = None
-        try:
-            _args = list(csv.reader([data.rstrip()], delimiter=' '))
-        except Exception:
-            pass
-        self.args = _args[0] if _args else []
+        self.__args = None
         self.is_canceled = False
         self.is_handled = False
         self.scroll_output = False
         self.stop_execution = False
+        self.stop_propagation = False
         self.on_success = on_success
         self.after = after
-        self.env = {}
-        self.__output = []
-        self.__triggered_events = []
+        self.__env = None
+        self.__output = _EMPTY
+        self.__triggered_events = _EMPTY
         self.set_input = False
         self.input = ''
 
+    @property
+    def args(self):
+        '''The words of data, split on spaces with csv style quoting.
+
+        Parsed on first use and cached, so events whose arguments are never
+        looked at, such as console output, do not pay for parsing them.
+        '''
+        if self.__args is None:
+            _args = None
+            try:
+                _args = list(csv.reader([self.data.rstrip()], delimiter=' '))
+            except Exception:
+                pass
+            self.__args = _args[0] if _args else []
+        return self.__args
+
+    @args.setter
+    def args(self, value):
+        self.__args = value
+
+    @property
+    def env(self):
+        '''The environment variables, normally set by the controler.'''
+        if self.__env is None:
+            self.__env = {}
+        return self.__env
+
+    @env.setter
+    def env(self, value):
+        self.__env = value
+
     def add_output(self, output):
         '''Add to the output of the event.
 
         Will be displayed to users
         '''
+        if not self.__output:
+            # A single line, the common case, is kept in a tuple
+            self.__output = (output,)
+            return
+        if not isinstance(self.__output, list):
+            self.__output = list(self.__output)
         self.__output.append(output)
 
     def get_output(self):
         return list(self.__output)
 
     def add_triggered_event(self, event):
+        if not isinstance(self.__triggered_events, list):
+            self.__triggered_events = list(self.__triggered_events)
         self.__triggered_events.append(event)
 
     def get_triggered_events(self):
         return list(self.__triggered_events)
 
 class PreInputEvent(Event):
+    __slots__ = ()
     event_type = Event.TYPE_PREINPUT
     def __init__(self, data, *args, **kwargs):
         super(PreInputEvent, self).__init__(data, *args, **kwargs)
-        self.event_type = Event.TYPE_PREINPUT
         self.add_output('>>> %s' % data)
         self.set_input = True
         evt = InputEvent(data)
         self.add_triggered_event(evt)
 
 class InputEvent(Event):
+    __slots__ = ()
     event_type = Event.TYPE_INPUT
     def __init__(self, data, *args, **kwargs):
         super(InputEvent, self).__init__(data, *args, **kwargs)
-        self.event_type = Event.TYPE_INPUT
 
 class OutputEvent(Event):
+    __slots__ = ()
     event_type = Event.TYPE_OUTPUT
     def __init__(self, data, *args, **kwargs):
         super(OutputEvent, self).__init__(data, *args, **kwargs)
         self.add_output(data)
-        self.event_type = Event.TYPE_OUTPUT
+
+class ChatEvent(Event):
+    __slots__ = ('player',)
+    event_type = Event.TYPE_CHAT
+    def __init__(self, data, player='', *args, **kwargs):
+        super(ChatEvent, self).__init__(data, *args, **kwargs)
+        self.player = player
+        self.add_output('<%s> %s' % (player, data))
+
+class PlayerConnectionEvent(Event):
+    __slots__ = ('player', 'action')
+    event_type = Event.TYPE_PLAYER_CONNECTION
+    def __init__(self, data, action='', *args, **kwargs):
+        super(PlayerConnectionEvent, self).__init__(data, *args, **kwargs)
+        self.player = data
+        self.action = action
+        self.add_output('* %s %s' % (data, action))
+
+class ReconnectEvent(Event):
+    __slots__ = ('feed', 'outage')
+    event_type = Event.TYPE_RECONNECT
+    def __init__(self, data, outage=0, *args, **kwargs):
+        super(ReconnectEvent, self).__init__(data, *args, **kwargs)
+        self.feed = data
+        self.outage = outage
+        self.add_output('--- %s feed reconnected after %.1f seconds ---' 
+                        % (data, outage))
 
 class QuitEvent(Event):
+    __slots__ = ()
     event_type = Event.TYPE_QUIT
     def __init__(self, data, *args, **kwargs):
         super(QuitEvent, self).__init__(data, *args, **kwargs)
-        self.event_type = Event.TYPE_QUIT
 
 class StartupEvent(Event):
+    __slots__ = ()
     event_type = Event.TYPE_STARTUP
     def __init__(self, data, *args, **kwargs):
         super(QuitEvent, self).__init__(data, *args, **kwargs)
-        self.event_type = Event.TYPE_STARTUP
 
 class ConnectEvent(Event):
+    __slots__ = ()
     event_type = Event.TYPE_CONNECT
     def __init__(self, data, *args, **kwargs):
         super(ConnectEvent, self).__init__(data, *args, **kwargs)
-        self.event_type = Event.TYPE_CONNECT
 
 class DisconnectEvent(Event):
+    __slots__ = ()
     event_type = Event.TYPE_DISCONNECT
     def __init__(self, data, *args, **kwargs):
         super(DisconnectEvent, self).__init__(data, *args, **kwargs)
-        self.event_type = Event.TYPE_DISCONNECT
 
 class KeyPressEvent(Event):
+    __slots__ = ('key',)
     event_type = Event.TYPE_KEYPRESS
     def __init__(self, data, key, *args, **kwargs):
         super(KeyPressEvent, self).__init__(data, *args, **kwargs)
-        self.event_type = Event.TYPE_KEYPRESS
         self.key = key
 
 # vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+from threading import Condition, Lock, Thread
+from time import time
+
+from Common.MinecraftApi import MinecraftJsonApi
+
+def fan_out(targets, action, on_result, timeout, on_done=None,
+        on_late=None):
+    '''Run action for every target concurrently.
+
+    targets is a dictionary of label => target. action(target) is run on a
+    thread per target and on_result(label, result, error) is called as each
+    one finishes. Targets still running after timeout seconds are reported
+    with a timeout error and their late results are passed to
+    on_late(label, result), if provided, so they can be released. on_done,
+    if provided, is called once every target has been reported.
+
+    Results are reported one at a time, so on_result needs no locking.
+    '''
+    lock = Condition()
+    pending = set(targets.keys())
+    def report(label, result, error):
+        with lock:
+            late = label not in pending
+            if not late:
+                pending.discard(label)
+                on_result(label, result, error)
+                lock.notify()
+        if late and result is not None and callable(on_late):
+            on_late(label, result)
+    def run(label, target):
+        try:
+            result = action(target)
+        except Exception as e:
+            report(label, None, e)
+            return
+        report(label, result, None)
+    def watch():
+        deadline = time() + timeout
+        with lock:
+            while pending and time() < deadline:
+                lock.wait(deadline - time())
+            for label in sorted(pending):
+                report(label, None,
+                       Exception('Timed out after %s seconds' % timeout))
+        if callable(on_done):
+            on_done()
+    threads = [Thread(target=run, args=item) for item in targets.items()]
+    threads.append(Thread(target=watch))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+class Fleet(object):
+    '''
+    A group of JSONAPI servers that commands are sent to together.
+
+    Servers are labelled "host:port". Connecting and calling happen on all
+    servers in parallel, with each server given at most timeout seconds.
+    Servers that connect after their timeout, or after disconnect, are
+    closed straight away.
+    '''
+    def __init__(self, name, timeout=10):
+        self.name = name
+        self.timeout = timeout
+        self.__servers = {}
+        self.__closed = False
+        self.__lock = Lock()
+
+    @staticmethod
+    def label(spec):
+        return '%s:%s' % (spec['host'], spec['port'])
+
+    def servers(self):
+        return sorted(self.__servers.keys())
+
+    def connect(self, specs, on_result, on_done=None):
+        '''Connect to every server in specs.
+
+        specs is a list of MinecraftJsonApi keyword argument dictionaries.
+        on_result(label, server, error) is called as each connect finishes.
+        '''
+        targets = dict([(self.label(spec), spec) for spec in specs])
+        def action(spec):
+            return MinecraftJsonApi(socket_timeout=self.timeout, **spec)
+        def connected(label, server, error):
+            if server is not None:
+                with self.__lock:
+                    closed = self.__closed
+                    if not closed:
+                        self.__servers[label] = server
+                if closed:
+                    server.close()
+                    server, error = None, Exception('Fleet disconnected')
+            on_result(label, server, error)
+        def late(label, server):
+            server.close()
+        fan_out(targets, action, connected, self.timeout, on_done, late)
+
+    def disconnect(self):
+        '''Close the connections to every server.
+
+        Servers still connecting are closed as soon as they connect.
+        '''
+        with self.__lock:
+            self.__closed = True
+            servers, self.__servers = self.__servers, {}
+        for server in servers.values():
+            server.close()
+
+    def call(self, method, args, on_result, on_done=None):
+        '''Call method on every server.
+
+        on_result(label, result, error) is called as each server answers.
+        '''
+        with self.__lock:
+            servers = dict(self.__servers)
+        fan_out(servers, lambda s: s.call(method, *args),
+                on_result, self.timeout, on_done)
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+import json
+
+from Common.Commands import CommandCategory, Command
+from Common.Events import *
+from Common.Fleet import Fleet
+
+FLEET_STORE = 'fleets'
+
+class FleetCommands(object):
+    '''Commands for sending input to a named group of servers at once.
+
+    Input starting with "@:" calls a JSONAPI method and input starting with
+    "@/" runs a console command on every server of the connected fleet.
+    '''
+    def __init__(self, controler):
+        self.__controler = controler
+        self.__datastore = controler.get_datastore('Fleet Commands')
+        if FLEET_STORE not in self.__datastore.keys():
+            self.__datastore[FLEET_STORE] = {}
+        self.__fleet = None
+
+    def __output(self, *lines):
+        evt = OutputEvent(lines[0])
+        for line in lines[1:]:
+            evt.add_output(line)
+        self.__controler.post_event(evt)
+
+    def __summary(self, action, counts):
+        def done():
+            self.__output('Fleet %s finished: %d ok, %d failed' %
+                          (action, counts[0], counts[1]))
+        return done
+
+    #region: Fleet Management
+    def __add(self):
+        opts = [
+            ('host', str, None, None, 'localhost'),
+            ('port', int, lambda x: x >= 0 and x <= 65535,
+                'port must be between 0 and 65535', 20059),
+            ('username', str, None, None, 'admin'),
+            ('password', str, None, None, 'demo'),
+            ('salt', str, None, None, ''),
+        ]
+        def add(event):
+            '''Add a server to a fleet
+            '''
+            name = event.args[1]
+            eargs = event.args[2:] + [None for x in opts]
+            spec = {}
+            for arg, validator in zip(eargs, opts):
+                if arg == None:
+                    arg = event.env.get('remote_'+validator[0], validator[4])
+                try:
+                    temp = validator[1](arg)
+                except Exception as e:
+                    event.add_output('Error: %s - %s' % (validator[0], e))
+                    event.is_handled = True
+                    return
+                if validator[2] and not validator[2](temp):
+                    event.add_output('Error: %s' % validator[3])
+                    event.is_handled = True
+                    return
+                spec[validator[0]] = temp
+            fleets = self.__datastore[FLEET_STORE]
+            members = [s for s in fleets.get(name, [])
+                         if Fleet.label(s) != Fleet.label(spec)]
+            fleets[name] = members + [spec]
+            event.add_output('Added %s to fleet %s' % (Fleet.label(spec),
+                                                       name))
+            event.is_handled = True
+        return Command(add,
+                    parameters=['fleet'] + ['_' + x[0] for x in opts],
+                    environment=[
+                        ('remote_host', 'Override default host (localhost)'),
+                        ('remote_port', 'Override default port (20079)'),
+                        ('remote_username', 'Override default user (admin)'),
+                        ('remote_password', 'Override default password (demo)'),
+                        ('remote_salt', 'Override default salt ()')
+                    ],
+                    events=[Event.TYPE_INPUT])
+
+    def __remove(self):
+        def remove(event):
+            '''Remove a server, or a whole fleet
+
+            Give the server as host:port, omit it to remove the fleet.
+            '''
+            fleets = self.__datastore[FLEET_STORE]
+            name = event.args[1]
+            if name not in fleets:
+                event.add_output('Fleet "%s" not found.' % name)
+            elif len(event.args) > 2:
+                fleets[name] = [s for s in fleets[name]
+                                  if Fleet.label(s) != event.args[2]]
+                event.add_output('Removed %s from fleet %s' %
+                                 (event.args[2], name))
+            else:
+                del fleets[name]
+                event.add_output('Removed fleet %s' % name)
+            event.is_handled = True
+        return Command(remove,
+                    parameters=['fleet', '_server'],
+                    events=[Event.TYPE_INPUT])
+
+    def __list(self):
+        def list_(event):
+            '''List fleets and their servers'''
+            fleets = self.__datastore[FLEET_STORE]
+            if not fleets:
+                event.add_output('No fleets defined')
+            for name in sorted(fleets.keys()):
+                active = (self.__fleet is not None and
+                          self.__fleet.name == name)
+                event.add_output('%s%s' % (name,
+                                 ' (connected)' if active else ''))
+                for spec in fleets[name]:
+                    event.add_output('\t%s' % Fleet.label(spec))
+            event.is_handled = True
+        return Command(list_, name='list', events=[Event.TYPE_INPUT])
+
+    def __connect(self):
+        def connect(event):
+            '''Connect to every server in a fleet
+
+            Each server is given timeout seconds (default 10) to answer.
+            '''
+            fleets = self.__datastore[FLEET_STORE]
+            name = event.args[1]
+            if not fleets.get(name):
+                event.add_output('Fleet "%s" not found or empty.' % name)
+                event.is_handled = True
+                return
+            try:
+                timeout = float(event.args[2]) if len(event.args) > 2 else 10
+            except ValueError as e:
+                event.add_output('Error: timeout - %s' % e)
+                event.is_handled = True
+                return
+            if self.__fleet is not None:
+                self.__fleet.disconnect()
+            self.__fleet = Fleet(name, timeout)
+            counts = [0, 0]
+            def connected(label, server, error):
+                if error is None:
+                    counts[0] += 1
+                    self.__output('[%s] Connected' % label)
+                else:
+                    counts[1] += 1
+                    self.__output('[%s] Error: Connect failed' % label,
+                                  str(error))
+            event.add_output('Connecting to fleet %s' % name)
+            self.__fleet.connect(fleets[name], connected,
+                                 self.__summary('connect', counts))
+            event.is_handled = True
+        return Command(connect,
+                    parameters=['fleet', '_timeout'],
+                    events=[Event.TYPE_INPUT])
+
+    def __disconnect(self):
+        def disconnect(event):
+            '''Disconnect from the connected fleet'''
+            if self.__fleet is not None:
+                self.__fleet.disconnect()
+                event.add_output('Disconnected from fleet %s' %
+                                 self.__fleet.name)
+            self.__fleet = None
+            event.is_handled = True
+        return Command(disconnect, events=[Event.TYPE_INPUT])
+
+    #endregion: Fleet Management
+
+    #region: Fan Out
+    def __fan_out(self):
+        def fan_out(event):
+            data = event.data
+            if len(data) < 2 or data[0] != '@' or data[1] not in ':/':
+                return
+            event.is_canceled = True
+            event.is_handled = True
+            echo = OutputEvent('>>> %s' % data)
+            echo.set_input = True
+            self.__controler.trigger_event(echo)
+            if self.__fleet is None:
+                self.__output('Not connected to a fleet')
+                return
+            if data[1] == '/':
+                method, args = 'runConsoleCommand', [data[2:]]
+            else:
+                method, args = event.args[0][2:], event.args[1:]
+            counts = [0, 0]
+            def result(label, rval, error):
+                if error is not None:
+                    counts[1] += 1
+                    self.__output('[%s] Error: %s' % (label, error))
+                    return
+                counts[0] += 1
+                if rval:
+                    self.__output('[%s] %s' % (label,
+                                  json.dumps(rval, indent=2)))
+                else:
+                    self.__output('[%s] OK' % label)
+            self.__fleet.call(method, args, result,
+                              self.__summary(method, counts))
+        return Command(fan_out, events=[Event.TYPE_PREINPUT])
+
+    #endregion: Fan Out
+
+    def create_commands(self):
+        category = CommandCategory('@', 'Fleet Commands',
+            'Commands sent to a group of servers')
+
+        category.add_command(self.__add())
+        category.add_command(self.__remove())
+        category.add_command(self.__list())
+        category.add_command(self.__connect())
+        category.add_command(self.__disconnect())
+        category.add_command(self.__fan_out())
+        return category
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+from bisect import bisect_left
+from threading import Lock
+
+class LatencyHistogram(object):
+    '''
+    Latency histogram with fixed, logarithmically spaced buckets.
+
+    Bucket bounds grow by 25% from 10 microseconds to over 100 seconds, so
+    recording is one bisect and an increment, memory use is constant and
+    percentiles are accurate to within one bucket.
+    '''
+    BOUNDS = [0.00001 * 1.25 ** i for i in xrange(73)]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.__buckets = [0] * (len(self.BOUNDS) + 1)
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.__buckets[bisect_left(self.BOUNDS, seconds)] += 1
+
+    def percentile(self, fraction):
+        '''
+        Get the upper bound of the bucket holding the given fraction of
+        samples, never more than the largest sample.
+        '''
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.__buckets):
+            seen += count
+            if seen >= wanted:
+                break
+        if index >= len(self.BOUNDS):
+            return self.max
+        return min(self.BOUNDS[index], self.max)
+
+    def summary(self):
+        '''
+        Get count, mean, p50, p95, p99 and max, with times in seconds.
+        '''
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+class Metrics(object):
+    '''
+    Thread safe collection of counters and latency histograms.
+
+    Histograms are kept per name and phase, for example the method called
+    and the "wait" phase of calling it.
+    '''
+    def __init__(self):
+        self.__histograms = {}
+        self.__counters = {}
+        self.__lock = Lock()
+
+    def record(self, name, phase, seconds):
+        '''Add a latency sample for phase of name.'''
+        with self.__lock:
+            histogram = self.__histograms.get((name, phase))
+            if histogram is None:
+                histogram = self.__histograms[(name, phase)] = \
+                    LatencyHistogram()
+            histogram.record(seconds)
+
+    def count(self, name, amount=1):
+        '''Increase the counter called name.'''
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+
+    def reset(self):
+        '''Forget every sample and counter.'''
+        with self.__lock:
+            self.__histograms = {}
+            self.__counters = {}
+
+    def snapshot(self):
+        '''
+        Get the current values as plain data.
+
+        Return a dictionary with "latency", mapping name to a dictionary of
+        phase to histogram summary, and "counters", mapping name to value.
+        '''
+        with self.__lock:
+            latency = {}
+            for (name, phase), histogram in self.__histograms.items():
+                latency.setdefault(name, {})[phase] = histogram.summary()
+            return {'latency': latency, 'counters': dict(self.__counters)}
+
+    def report(self):
+        '''
+        Get the current values as lines of text, times in milliseconds.
+        '''
+        snapshot = self.snapshot()
+        lines = []
+        template = '%-32s %-9s %8s %9s %9s %9s %9s'
+        if snapshot['latency']:
+            lines.append(template % ('name', 'phase', 'count', 'p50',
+                                     'p95', 'p99', 'max'))
+        for name in sorted(snapshot['latency'].keys()):
+            phases = snapshot['latency'][name]
+            for phase in sorted(phases.keys()):
+                summary = phases[phase]
+                lines.append(template % (name, phase, summary['count'],
+                    '%.2f' % (summary['p50'] * 1000),
+                    '%.2f' % (summary['p95'] * 1000),
+                    '%.2f' % (summary['p99'] * 1000),
+                    '%.2f' % (summary['max'] * 1000)))
+        for name in sorted(snapshot['counters'].keys()):
+            lines.append('%s: %s' % (name, snapshot['counters'][name]))
+        return lines
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
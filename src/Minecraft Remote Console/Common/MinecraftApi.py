@@ -1,30 +1,587 @@
 #!/usr/bin/python
 # vim: set shiftwidth=4 softtabstop=4 expandtab autoindent syntax=python:
 
+import errno
 import json
+import pickle
 import socket
+import zlib
+from bisect import bisect_left, insort
+from collections import deque, OrderedDict
 from hashlib import sha256
+from httplib import (BadStatusLine, HTTPConnection, HTTPException,
+                     HTTPResponse)
+from os import path
+from threading import Event, Lock
+from time import time
 from urllib import urlencode
-from urllib import urlopen
+
+from Common.Metrics import Metrics
+
+def decompress(body, encoding):
+    '''
+    Decode an HTTP body sent with the given Content-Encoding.
+    '''
+    encoding = (encoding or '').lower()
+    if encoding in ['gzip', 'x-gzip']:
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+class LineBuffer(object):
+    '''
+    Frames newline terminated lines out of a reusable bytearray.
+
+    Data is received straight into the buffer, complete lines are located
+    with find() and sliced through a memoryview, and every complete line
+    currently buffered is decoded with a single copy and decode.
+
+    With detect_compression set, a stream whose first byte is a zlib 
+    header is inflated as it is received, any other stream is read as is.
+    bytes_received counts bytes read from the socket and bytes_decoded the
+    bytes they expanded to.
+    '''
+    def __init__(self, size=65536, detect_compression=False):
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+        self.__start = 0
+        self.__end = 0
+        self.__detect = detect_compression
+        self.__inflater = None
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+
+    def __len__(self):
+        return self.__end - self.__start
+
+    def __reserve(self, size):
+        '''
+        Make room for at least size more bytes at the end of the buffer.
+        '''
+        if len(self.__buffer) - self.__end >= size:
+            return
+        pending = self.__view[self.__start:self.__end].tobytes()
+        capacity = len(self.__buffer)
+        while capacity - len(pending) < size:
+            capacity *= 2
+        if capacity != len(self.__buffer):
+            self.__buffer = bytearray(capacity)
+            self.__view = memoryview(self.__buffer)
+        self.__buffer[0:len(pending)] = pending
+        self.__start = 0
+        self.__end = len(pending)
+
+    def recv_from(self, sock, size=None):
+        '''
+        Receive available data from sock into the buffer.
+
+        Return the number of bytes received, 0 meaning end of stream.
+        '''
+        size = size or len(self.__buffer) // 2
+        if self.__detect or self.__inflater is not None:
+            data = sock.recv(size)
+            self.bytes_received += len(data)
+            if self.__detect and data:
+                self.__detect = False
+                if data[:1] == b'\x78':
+                    self.__inflater = zlib.decompressobj()
+            self.write(self.__inflater.decompress(data) 
+                       if self.__inflater is not None else data)
+            return len(data)
+        self.__reserve(size)
+        count = sock.recv_into(self.__view[self.__end:], size)
+        self.__end += count
+        self.bytes_received += count
+        self.bytes_decoded += count
+        return count
+
+    def write(self, data):
+        '''
+        Append data to the buffer.
+        '''
+        self.__reserve(len(data))
+        self.__buffer[self.__end:self.__end + len(data)] = data
+        self.__end += len(data)
+        self.bytes_decoded += len(data)
+
+    def lines(self):
+        '''
+        Remove and return every complete line in the buffer.
+
+        Lines are returned decoded and without their line terminator.
+        '''
+        last = self.__buffer.rfind(b'\n', self.__start, self.__end)
+        if last < 0:
+            return []
+        text = self.__view[self.__start:last].tobytes().decode('utf-8')
+        self.__start = last + 1
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+        return text.split(u'\n')
 
 class MinecraftStream(object):
-    #	Extends the basic stream object and adds a readjson method to the object
-    def __getattribute__(self, name):
-        if name not in ['readjson', '_original_stream']:
-            return getattr(
-                object.__getattribute__(self, '_original_stream'), 
-                name
-            )
-        else:
-            return object.__getattribute__(self, name)
-        
-    def __init__(self, stream):
-        self._original_stream = stream
-        
-    def readjson(self, *args, **kwargs):
-        ret = self._original_stream.readline(*args, **kwargs)
-        return json.loads(ret[2:])
-    
+    '''
+    Buffered reader for a JSONAPI stream socket.
+
+    Reads large chunks into a LineBuffer and queues every complete line,
+    so a busy feed is drained with few socket reads and decodes. Use 
+    readline for raw lines, readjson or readjson_batch for parsed values.
+
+    If metrics is given, time spent decoding is recorded against name.
+    '''
+    def __init__(self, sock, buffer_size=65536, detect_compression=False,
+            metrics=None, name='stream'):
+        self.__sock = sock
+        self.__buffer = LineBuffer(buffer_size, detect_compression)
+        self.__lines = deque()
+        self.__metrics = metrics
+        self.__name = name
+        self.closed = False
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    def transfer_stats(self):
+        '''
+        Get the bytes received from the socket and after decompression.
+        '''
+        return {
+            'bytes_received': self.__buffer.bytes_received,
+            'bytes_decoded': self.__buffer.bytes_decoded,
+        }
+
+    def write(self, data):
+        self.__sock.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+        self.__sock.close()
+
+    def fill(self):
+        '''
+        Read one chunk from the socket, blocking until data arrives.
+
+        Return the number of complete lines now queued.
+        '''
+        if not self.__buffer.recv_from(self.__sock):
+            self.closed = True
+        self.__lines.extend(self.__buffer.lines())
+        return len(self.__lines)
+
+    def readline(self):
+        '''
+        Read one decoded line, or an empty string at end of stream.
+        '''
+        while not self.__lines:
+            if self.closed:
+                return u''
+            self.fill()
+        return self.__lines.popleft()
+
+    def readjson(self):
+        '''
+        Read and parse one JSON message.
+        '''
+        return json.loads(self.readline())
+
+    def readjson_batch(self, max_lines=None):
+        '''
+        Read and parse up to max_lines JSON messages.
+
+        Blocks for at most one socket read when no lines are queued, 
+        returning an empty list at end of stream.
+        '''
+        if not self.__lines and not self.closed:
+            self.fill()
+        count = len(self.__lines)
+        if max_lines is not None:
+            count = min(count, max_lines)
+        popleft = self.__lines.popleft
+        start = time()
+        messages = [json.loads(line) for line in 
+                    [popleft() for i in xrange(count)] if line.strip()]
+        if self.__metrics is not None and messages:
+            self.__metrics.record(self.__name, 'decode', time() - start)
+            self.__metrics.count('%s messages' % self.__name, len(messages))
+        return messages
+
+class ConnectionPool(object):
+    '''
+    Pool of persistent HTTP/1.1 connections to a single (host, port).
+
+    Connections are handed out by request() and returned to the pool once
+    the response has been read, so consecutive calls reuse the same TCP
+    connection instead of paying for a new handshake each time. Idle
+    connections older than `timeout` seconds are assumed stale and are
+    closed rather than reused. A request that fails on a reused connection
+    before any response arrives, because the server had already closed the
+    socket, is sent again exactly once on a new connection. Other failures,
+    timeouts in particular, are never resent, since the server may have
+    run the call. If socket_timeout is set, blocking socket operations give
+    up after that many seconds.
+
+    With compression set, gzip and deflate responses are offered to the
+    server and decoded transparently; servers that ignore the offer reply
+    uncompressed as usual. bytes_received and bytes_decoded count response
+    body bytes on the wire and after decompression.
+    '''
+    ACCEPT_ENCODING = 'gzip, deflate'
+    DROPPED_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+    def __init__(self, host, port, size=4, timeout=30, socket_timeout=None,
+            compression=False):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.socket_timeout = socket_timeout
+        self.compression = compression
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.__idle = []
+        self.__lock = Lock()
+
+    def __read(self, response):
+        '''
+        Read and decompress a response body, counting transferred bytes.
+        '''
+        body = response.read()
+        decoded = decompress(body, response.getheader('content-encoding'))
+        with self.__lock:
+            self.bytes_received += len(body)
+            self.bytes_decoded += len(decoded)
+        return decoded
+
+    def __dropped(self, error):
+        '''
+        Check whether error shows the server closed a keep-alive socket.
+        '''
+        if isinstance(error, socket.timeout):
+            return False
+        if isinstance(error, BadStatusLine):
+            return True
+        return (isinstance(error, socket.error) and
+                getattr(error, 'errno', None) in self.DROPPED_ERRNOS)
+
+    def acquire(self, fresh=False):
+        '''
+        Get a connection from the pool, creating one if none are idle or
+        fresh is set.
+
+        Return a tuple of (connection, reused).
+        '''
+        now = time()
+        with self.__lock:
+            while self.__idle and not fresh:
+                conn, last_used = self.__idle.pop()
+                if now - last_used < self.timeout:
+                    return conn, True
+                conn.close()
+        if self.socket_timeout is not None:
+            return HTTPConnection(self.host, self.port, 
+                                  timeout=self.socket_timeout), False
+        return HTTPConnection(self.host, self.port), False
+
+    def release(self, conn):
+        '''
+        Return a connection to the pool, closing it if the pool is full.
+        '''
+        with self.__lock:
+            if len(self.__idle) < self.size:
+                self.__idle.append((conn, time()))
+                return
+        conn.close()
+
+    def close(self):
+        '''
+        Close all idle connections.
+        '''
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for conn, last_used in idle:
+            conn.close()
+
+    def request(self, path, phases=None):
+        '''
+        Perform a GET request for path.
+
+        Return a tuple of (status, body). If phases is a dictionary, the 
+        seconds spent connecting and then waiting for the whole response
+        are added to its "connect" and "wait" entries.
+        '''
+        retried = False
+        while True:
+            conn, reused = self.acquire(fresh=retried)
+            response = None
+            try:
+                headers = {}
+                if self.compression:
+                    headers['Accept-Encoding'] = self.ACCEPT_ENCODING
+                start = time()
+                if conn.sock is None:
+                    conn.connect()
+                connected = time()
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = self.__read(response)
+                if phases is not None:
+                    phases['connect'] = (phases.get('connect', 0.0) + 
+                                         connected - start)
+                    phases['wait'] = (phases.get('wait', 0.0) + 
+                                      time() - connected)
+            except (HTTPException, socket.error) as e:
+                conn.close()
+                if (reused and not retried and response is None and
+                        self.__dropped(e)):
+                    # Server dropped the keep-alive socket, try a fresh one
+                    retried = True
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(conn)
+            return response.status, body
+
+    def pipeline(self, paths):
+        '''
+        Perform GET requests for all paths over a single connection.
+
+        All requests are written before any response is read. If the server
+        closes the connection part way through, the remaining requests are
+        sent again on a new connection. Return the response bodies in the
+        same order as paths.
+        '''
+        template = 'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n'
+        if self.compression:
+            template += 'Accept-Encoding: %s\r\n' % self.ACCEPT_ENCODING
+        template += '\r\n'
+        bodies = []
+        pending = list(paths)
+        retried = False
+        while pending:
+            conn, reused = self.acquire(fresh=retried)
+            response = None
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                conn.sock.sendall(''.join([template.format(
+                    path = path,
+                    host = self.host,
+                    port = self.port,
+                ) for path in pending]).encode())
+                while pending:
+                    begun = HTTPResponse(conn.sock, method='GET')
+                    begun.begin()
+                    response = begun
+                    bodies.append(self.__read(response))
+                    pending.pop(0)
+                    if response.will_close:
+                        break
+            except (HTTPException, socket.error) as e:
+                conn.close()
+                # Only resend if nothing was answered on this connection
+                if (reused and not retried and response is None and
+                        self.__dropped(e)):
+                    retried = True
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(conn)
+        return bodies
+
+class MethodRegistry(object):
+    '''
+    Indexed collection of method definitions loaded from the server.
+
+    Methods are indexed by method_name and by namespace, the enabled 
+    methods are kept as a ready made list and method names are kept 
+    sorted so that prefix lookups only touch the matching names.
+    '''
+    def __init__(self, methods=None):
+        self.__methods = []
+        self.__enabled = []
+        self.__by_name = {}
+        self.__by_namespace = {}
+        self.__names = []
+        for method in methods or []:
+            self.add(method)
+
+    def __iter__(self):
+        return iter(self.__methods)
+
+    def __len__(self):
+        return len(self.__methods)
+
+    def add(self, method):
+        '''
+        Add a method definition to the registry.
+
+        If a method with the same method_name is already present the first
+        definition wins lookups by name.
+        '''
+        name = method['method_name']
+        self.__methods.append(method)
+        if method.get('enabled', False):
+            self.__enabled.append(method)
+        self.__by_namespace.setdefault(method['namespace'], []).append(method)
+        if name not in self.__by_name:
+            self.__by_name[name] = method
+            insort(self.__names, name)
+
+    def get(self, name):
+        '''
+        Get the method definition for method_name, or None.
+        '''
+        return self.__by_name.get(name, None)
+
+    def methods(self, active_only=True):
+        '''
+        Get all method definitions, or only the enabled ones.
+
+        The returned list is shared and must not be modified.
+        '''
+        return self.__enabled if active_only else self.__methods
+
+    def namespace(self, namespace, active_only=True):
+        '''
+        Get the method definitions in namespace.
+        '''
+        methods = self.__by_namespace.get(namespace, [])
+        if active_only:
+            return [m for m in methods if m.get('enabled', False)]
+        return list(methods)
+
+    def complete(self, prefix, active_only=True):
+        '''
+        Get the method definitions whose method_name starts with prefix.
+        '''
+        names = self.__names
+        matches = []
+        for pos in xrange(bisect_left(names, prefix), len(names)):
+            if not names[pos].startswith(prefix):
+                break
+            method = self.__by_name[names[pos]]
+            if not active_only or method.get('enabled', False):
+                matches.append(method)
+        return matches
+
+class ResultCache(object):
+    '''
+    Bounded LRU cache of call results that expire after a per-entry TTL.
+    '''
+    def __init__(self, size=256):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key):
+        '''
+        Look up key, returning a tuple of (found, value).
+        '''
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is None or entry[0] < time():
+                self.misses += 1
+                return False, None
+            self.__entries[key] = entry
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value, ttl):
+        '''
+        Store value under key for ttl seconds, evicting the least recently
+        used entries beyond the size limit.
+        '''
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (time() + ttl, value)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+class SingleFlight(object):
+    '''
+    Shares one in-flight call between concurrent identical callers.
+
+    The first caller for a key performs the call, callers arriving while
+    it is running wait for and share its result. calls counts every call
+    made through the SingleFlight and coalesced the ones that were shared.
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.__flights = {}
+        self.__pending = {}
+        self.__lock = Lock()
+
+    def do(self, key, func):
+        '''
+        Return func(), sharing the result with identical concurrent calls.
+        '''
+        with self.__lock:
+            self.calls += 1
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights[key] = [Event(), None, None]
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1]
+        try:
+            flight[1] = func()
+        except Exception as e:
+            flight[2] = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+            flight[0].set()
+        return flight[1]
+
+    def do_async(self, key, start):
+        '''
+        Return start(), or the pending result of an identical call.
+
+        start must return an object with an add_callback method, such as an
+        AsyncResult, which is shared until it completes.
+        '''
+        with self.__lock:
+            self.calls += 1
+            result = self.__pending.get(key)
+            if result is not None:
+                self.coalesced += 1
+                return result
+            result = self.__pending[key] = start()
+        def forget(done):
+            with self.__lock:
+                if self.__pending.get(key) is result:
+                    del self.__pending[key]
+        result.add_callback(forget)
+        return result
+
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
 class MinecraftJsonApi (object):
     '''
     Python Interface to JSONAPI for Bukkit (Minecraft)
@@ -41,9 +598,13 @@ class MinecraftJsonApi (object):
         http://ramblingwood.com/minecraft/jsonapi/
     '''
     
-    __basic_url = 'http://{host}:{port}/api/call?{query}'
+    __basic_url = '/api/call?{query}'
+    __multiple_url = '/api/call-multiple?{query}'
     __subscribe_url = '/api/subscribe?{query}'
     __letters = list('abcdefghijklmnopqrstuvwxyz')
+    __cache_lock = Lock()
+    READ_ONLY_PREFIXES = ('get', 'is', 'has')
+    METHOD_CACHE_PATH = path.expanduser('~/.MinecraftRemoteConsole.methods')
         
     def __createkey(self, method):
         '''
@@ -57,15 +618,13 @@ class MinecraftJsonApi (object):
             ).encode()
         ).hexdigest()
     
-    def __createURL(self, method, args):
+    def _createURL(self, method, args):
         '''
-        Create the full URL for calling a method.
+        Create the request path for calling a method.
         '''			
         key = self.__createkey(method)
         
         return self.__basic_url.format(
-            host = self.host,
-            port = self.port,
             query = urlencode([
                 ('method', method),
                 ('args', json.dumps(args)),
@@ -73,23 +632,41 @@ class MinecraftJsonApi (object):
             ])
         )
     
-    def __createStreamURL(self, source):
+    def _createMultipleURL(self, methods, args):
         '''
-        Create the full URL for subscribing to a stream.
-        '''			
-        key = self.__createkey(source)
-        
-        return self.__subscribe_url.format(
+        Create the request path for calling several methods at once.
+        '''
+        methods = json.dumps(methods)
+        key = self.__createkey(methods)
+
+        return self.__multiple_url.format(
             query = urlencode([
-                ('source', source),
+                ('method', methods),
+                ('args', json.dumps(args)),
                 ('key', key),
             ])
         )
+
+    def _createStreamURL(self, source):
+        '''
+        Create the full URL for subscribing to a stream.
+        '''			
+        key = self.__createkey(source)
+        query = [
+            ('source', source),
+            ('key', key),
+        ]
+        if self.stream_compression:
+            # Servers that do not understand this ignore it and reply with
+            # plain JSON lines, which the stream reader detects.
+            query.append(('compression', 'deflate'))
+        
+        return self.__subscribe_url.format(query = urlencode(query))
     
-    def __createsocket(self):
+    def __createsocket(self, feed):
         '''
         Setup a socket connection to the server and return a file like 
-        object for reading and writing.
+        object for reading and writing feed.
         
         Copied with minor edits from examples on: 
             http://docs.python.org/library/socket.html
@@ -113,7 +690,9 @@ class MinecraftJsonApi (object):
             break
         if not sock:
             raise Exception('Connect failed') 
-        return MinecraftStream(sock.makefile('rwb'))
+        return MinecraftStream(sock, 
+                               detect_compression=self.stream_compression,
+                               metrics=self.metrics, name='feed:%s' % feed)
 
     def __createMethodAttributes(self, method):
         '''
@@ -130,6 +709,7 @@ class MinecraftJsonApi (object):
         attrs['description'] = method.get('desc','')
         attrs['namespace'] = method.get('namespace','')
         attrs['enabled'] = method.get('enabled',False)
+        attrs['cacheable'] = attrs['name'].startswith(self.READ_ONLY_PREFIXES)
         if attrs['namespace']:
             attrs['method_name'] = attrs['namespace'] + '.'+attrs['name']
         else:
@@ -150,20 +730,35 @@ class MinecraftJsonApi (object):
         guaranteed to exist for all servers, when in doubt 
         MinecraftJsonApi.call should be used instead.
         '''
+        self.clearResultCache()
         # Retrieve the JSON config files used by JSONAPI and 
         # server plugin list 
-        files = [i for i in self.call('getPluginFiles','JSONAPI') if i.endswith('json')]
-        plugins = self.call('getPlugins',[])
-        for target in files:
-            contents = self.call('getFileContents', target)
-            config = json.loads(contents)
+        files, plugins = self.__unwrapMany(self.call_many([
+            ('getPluginFiles', ['JSONAPI']),
+            ('getPlugins', []),
+        ]))
+        files = [i for i in files if i.endswith('json')]
+
+        # Reuse the processed method list if nothing changed since the
+        # last time this server was loaded
+        fingerprint = sha256(json.dumps([files, plugins], 
+            sort_keys=True).encode()).hexdigest()
+        if self.method_cache:
+            cached = self.__readMethodCache().get((self.host, self.port))
+            if cached and cached['fingerprint'] == fingerprint:
+                self.__methods = MethodRegistry(cached['methods'])
+                return
+
+        active = set([m['name'] for m in plugins if m['enabled']])
+
+        # Fetch every definition file in a single batch
+        contents = self.__unwrapMany(self.call_many(
+            [('getFileContents', [target]) for target in files]))
+        methods = MethodRegistry()
+        for data in contents:
+            config = json.loads(data)
             
-            enabled = True
-            for dep in config['depends']:
-                match = [m for m in plugins if m['name'] == dep and m['enabled']]
-                if len(match) < 1:
-                    enabled = False
-                    break
+            enabled = active.issuperset(config['depends'])
             
             namespace = config['namespace']
             for method in config['methods']:
@@ -172,53 +767,337 @@ class MinecraftJsonApi (object):
 
                 cfg = self.__createMethodAttributes(method) 
                 cfg['params'] = [s for s in cfg['params'].split('\n') if len(s)] 
-                self.__methods.append(cfg)
+                methods.add(cfg)
+        self.__methods = methods
+
+        if self.method_cache:
+            with self.__cache_lock:
+                cache = self.__readMethodCache()
+                cache[(self.host, self.port)] = {
+                    'fingerprint': fingerprint,
+                    'methods': list(self.__methods),
+                }
+                self.__writeMethodCache(cache)
+
+    def __readMethodCache(self):
+        '''
+        Read the on disk method cache, returning an empty cache on error.
+        '''
+        try:
+            with open(self.METHOD_CACHE_PATH, 'rb') as cache:
+                return pickle.load(cache)
+        except Exception:
+            return {}
+
+    def __writeMethodCache(self, cache):
+        '''
+        Write the method cache to disk.
+        '''
+        try:
+            with open(self.METHOD_CACHE_PATH, 'wb') as stream:
+                pickle.dump(cache, stream, -1)
+        except (IOError, OSError):
+            pass
+
+    def invalidateMethodCache(self):
+        '''
+        Forget any cached method definitions for this server.
+
+        The next load will fetch and parse every definition file again.
+        '''
+        with self.__cache_lock:
+            cache = self.__readMethodCache()
+            if (self.host, self.port) in cache:
+                del cache[(self.host, self.port)]
+                self.__writeMethodCache(cache)
     
     def __init__(self, host='localhost', port=20059, username='admin', 
-        password='demo', salt='', autoload_methods=True):
+        password='demo', salt='', autoload_methods=True, pool_size=4,
+        pool_timeout=30, method_cache=True, socket_timeout=None,
+        result_cache=False, cache_size=256, cache_ttl=5, coalesce=True,
+        compression=True, stream_compression=False):
         self.host = host
         self.username = username
         self.password = password
         self.port = port
         self.salt = salt
-        self.__methods = []
+        self.method_cache = method_cache
+        self.socket_timeout = socket_timeout
+        self.compression = compression
+        self.stream_compression = stream_compression
+        self.__methods = MethodRegistry()
+        self.__pool = ConnectionPool(host, port, pool_size, pool_timeout,
+                                     socket_timeout, compression)
+        self.__multiple_supported = None
+        self.cache_ttl = cache_ttl
+        self.__results = ResultCache(cache_size) if result_cache else None
+        self.__cache_rules = {}
+        self.flights = SingleFlight() if coalesce else None
+        self.metrics = Metrics()
         if autoload_methods:
             self.__loadMethods()
                 
+    def __request(self, method, args, decode):
+        '''
+        Make a remote call and return the response passed through decode.
+
+        Time spent signing, connecting, waiting and decoding is recorded
+        in metrics against method.
+        '''
+        start = time()
+        url = self._createURL(method, args)
+        phases = {'sign': time() - start}
+        status, result = self.__pool.request(url, phases)
+        start = time()
+        value = decode(result)
+        phases['decode'] = time() - start
+        for phase, seconds in phases.items():
+            self.metrics.record(method, phase, seconds)
+        return value
+
     def rawCall (self, method, *args):
         '''
         Make a remote call and return the raw response.
         '''
-        url = self.__createURL(method, args)
-        result = urlopen(url).read()
-        return result.decode()
-                
+        return self.__request(method, args, lambda r: r.decode())
+
+    def __fetch(self, method, args):
+        '''
+        Make a remote call and return the decoded JSON response.
+
+        The response bytes are handed straight to the JSON decoder, which
+        decodes strings as it parses, instead of first building a decoded
+        copy of the whole body.
+        '''
+        return self.__request(method, args, json.loads)
+
+    def close (self):
+        '''
+        Close any persistent connections held to the remote server.
+        '''
+        self.__pool.close()
+        self.clearResultCache()
+
+    def getTransferStats(self):
+        '''
+        Get response bytes received on the wire and after decompression.
+        '''
+        return {
+            'bytes_received': self.__pool.bytes_received,
+            'bytes_decoded': self.__pool.bytes_decoded,
+        }
+
+    def getStats(self):
+        '''
+        Get latency histograms, counters, transfer, coalescing and result
+        cache statistics as one JSON serializable dictionary.
+        '''
+        stats = self.metrics.snapshot()
+        stats['transfer'] = self.getTransferStats()
+        if self.flights is not None:
+            stats['coalescing'] = self.flights.stats()
+        if self.__results is not None:
+            stats['result_cache'] = {
+                'hits': self.__results.hits,
+                'misses': self.__results.misses,
+            }
+        return stats
+
+    def setCacheRule(self, method, ttl, mutating=False):
+        '''
+        Set how long results of method are cached for, and whether it
+        changes server state.
+
+        A ttl of 0 or None means results are never cached, while identical
+        concurrent calls may still share a request. Calling a mutating
+        method clears the result cache, and its calls are never cached or
+        shared. Rules override the defaults taken from the method
+        definitions, where read-only methods are cached for cache_ttl
+        seconds and every other defined method is mutating.
+        '''
+        self.__cache_rules[method] = (0 if mutating else ttl or 0,
+                                      bool(mutating))
+
+    def clearResultCache(self):
+        '''
+        Forget every cached call result.
+        '''
+        if self.__results is not None:
+            self.__results.clear()
+
+    def getResultCache(self):
+        '''
+        Get the ResultCache, or None if result caching is disabled.
+        '''
+        return self.__results
+
+    def __cacheRule(self, method):
+        '''
+        Get (ttl, mutating) for method.
+
+        ttl is the number of seconds to cache its results for. mutating is
+        True if it changes server state, False if it is read-only and None
+        if it is unknown, in which case it is neither cached nor clears the
+        cache.
+        '''
+        rule = self.__cache_rules.get(method)
+        if rule is not None:
+            return rule
+        definition = self.__methods.get(method)
+        if definition is None:
+            return 0, None
+        if definition.get('cacheable',
+                definition['name'].startswith(self.READ_ONLY_PREFIXES)):
+            return self.cache_ttl, False
+        return 0, True
                 
+    def isReadOnly(self, method):
+        '''
+        Check whether method is known not to change server state.
+        '''
+        return self.__cacheRule(method)[1] is False
+
     def call (self, method, *args):
         '''
         Make a remote call and return the JSON response.
+
+        Identical concurrent calls to read-only methods share a single 
+        request. When result caching is enabled, results of read-only 
+        methods may be served from the cache. Shared and cached results 
+        must not be modified.
+        '''
+        start = time()
+        try:
+            return self.__call(method, args)
+        except Exception:
+            self.metrics.count('%s errors' % method)
+            raise
+        finally:
+            self.metrics.record(method, 'total', time() - start)
+
+    def __call(self, method, args):
+        ttl, mutating = self.__cacheRule(method)
+        if mutating is not False:
+            if mutating and self.__results is not None:
+                self.__results.clear()
+            return self._parseResult(self.__fetch(method, args))
+
+        key = (method, json.dumps(args))
+        if ttl and self.__results is not None:
+            found, value = self.__results.get(key)
+            if found:
+                return value
+        def fetch():
+            return self._parseResult(self.__fetch(method, args))
+        if self.flights is not None:
+            value = self.flights.do(key, fetch)
+        else:
+            value = fetch()
+        if ttl and self.__results is not None:
+            self.__results.put(key, value, ttl)
+        return value
+
+    def _parseResult(self, result):
+        '''
+        Unwrap a decoded JSONAPI response, raising if it is not a success.
         '''
-        data = self.rawCall(method, *args)
-        result = json.loads(data)
         if result['result'] =='success':
             return result['success']	
         else:
             raise Exception('(%s) %s' %(result['result'], result[result['result']]))
+
+    def _parseEntry(self, entry):
+        '''
+        Unwrap a single result from a call-multiple response.
+
+        Entries wrapped in their own result envelope are unwrapped, failed
+        entries are returned as an Exception rather than raised.
+        '''
+        if (isinstance(entry, dict) and 
+                entry.get('result') in ['success', 'error'] and
+                entry['result'] in entry):
+            try:
+                return self._parseResult(entry)
+            except Exception as e:
+                return e
+        return entry
+
+    def __unwrapMany(self, results):
+        '''
+        Raise the first error found in a list of call_many results.
+        '''
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def call_many (self, calls):
+        '''
+        Make several remote calls in one request.
+
+        calls is a sequence of (method, args) tuples, where args is a 
+        sequence of arguments for that method. Return a list of results in
+        the same order as calls; an entry that failed is returned as an
+        Exception instead of raising.
+
+        Uses the JSONAPI call-multiple endpoint where available, otherwise 
+        falls back to pipelining the individual calls over one connection.
+        '''
+        if not calls:
+            return []
+        methods = [c[0] for c in calls]
+        if (self.__results is not None and 
+                any([self.__cacheRule(m)[1] for m in methods])):
+            self.__results.clear()
+        args = [list(c[1]) for c in calls]
+
+        if self.__multiple_supported is not False:
+            start = time()
+            url = self._createMultipleURL(methods, args)
+            phases = {'sign': time() - start}
+            status, data = self.__pool.request(url, phases)
+            for phase, seconds in phases.items():
+                self.metrics.record('call-multiple', phase, seconds)
+            try:
+                result = json.loads(data) if status != 404 else None
+            except ValueError:
+                result = None
+            if not isinstance(result, dict):
+                # Server does not know about call-multiple
+                self.__multiple_supported = False
+            else:
+                self.__multiple_supported = True
+                entries = result.get('success')
+                if (result.get('result') == 'success' and 
+                        isinstance(entries, list) and
+                        len(entries) == len(calls)):
+                    return [self._parseEntry(e) for e in entries]
+                # The batch failed as a whole, fall through so every entry
+                # gets its own result or error.
+
+        results = []
+        paths = [self._createURL(m, a) for m, a in zip(methods, args)]
+        for data in self.__pool.pipeline(paths):
+            try:
+                results.append(self._parseResult(json.loads(data)))
+            except Exception as e:
+                results.append(e)
+        return results
     
     
     def subscribe (self, feed):
         '''
         Subscribe to the remote stream.
         
-        Return a file like object for reading responses from. Use 
-        read/readline for raw values, use readjson for parsed values.
+        Return a MinecraftStream for reading responses from. Use readline
+        for raw lines, use readjson or readjson_batch for parsed values.
         '''
         if feed not in ['console', 'chat', 'connections']:
             raise NotImplementedError(
                 'Subscribing to feed \'%s\' is not supported.' % feed)
     
-        url = self.__createStreamURL(feed)
-        stream = self.__createsocket()
+        url = self._createStreamURL(feed)
+        stream = self.__createsocket(feed)
     
         stream.write(url.encode())
         stream.write('\n'.encode())
@@ -229,25 +1108,31 @@ class MinecraftJsonApi (object):
     def getLoadedMethods(self, active_only=True):
         '''
         Get all methods recognized by the remote server.
+
+        The returned list is shared and must not be modified.
         '''
-        if active_only:
-            test = lambda x: x.get('enabled', False)
-        else:
-            test = lambda x: True
-        return [a for a in self.__methods if test(a)]
+        return self.__methods.methods(active_only)
+
+    def getNamespaceMethods(self, namespace, active_only=True):
+        '''
+        Get all methods in the provided namespace.
+        '''
+        return self.__methods.namespace(namespace, active_only)
+
+    def completeMethod(self, prefix, active_only=True):
+        '''
+        Get all methods whose full method name starts with prefix.
+        '''
+        return self.__methods.complete(prefix, active_only)
     
     def getMethod(self, name):
         '''
         get method definition for the provided method name.
         
         If the method is in a name space the namespace must be provided
-        too, the name having the form "{namespace}_{name}"
+        too, the name having the form "{namespace}.{name}"
         '''
-        method = [m for m in self.__methods if m['method_name'] == name]
-        if len(method):
-            return method[0]
-        else:
-            return None
+        return self.__methods.get(name)
 
 if __name__ == '__main__':
     # Some basic test code
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+import cProfile
+from threading import Lock
+
+class HandlerProfiler(object):
+    '''
+    Call counts and wall time of command handlers, per event type.
+
+    Command.invoke and CommandCategory.invoke report to the shared
+    profiler instance while it is enabled; when it is not, the hooks cost
+    a single attribute check. A capture can also run cProfile on the
+    thread that started it, normally the event dispatcher, and dump
+    cProfile compatible stats when stopped.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.__stats = {}
+        self.__profile = None
+        self.__lock = Lock()
+
+    def record(self, kind, name, event_type, seconds):
+        '''Add one call of the handler name to the capture.'''
+        key = (kind, name, event_type)
+        with self.__lock:
+            stats = self.__stats.get(key)
+            if stats is None:
+                stats = self.__stats[key] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+    def start(self, filename=None):
+        '''
+        Forget the previous capture and start a new one.
+
+        With filename, also run cProfile until stop() and write its stats
+        there.
+        '''
+        self.stop()
+        with self.__lock:
+            self.__stats = {}
+        self.filename = filename
+        if filename is not None:
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        self.enabled = True
+
+    def stop(self):
+        '''
+        Stop capturing, writing the cProfile stats if requested.
+
+        Return the name of the file written, or None. The stats are only
+        written once; errors writing them are raised.
+        '''
+        self.enabled = False
+        profile, self.__profile = self.__profile, None
+        filename, self.filename = self.filename, None
+        if profile is None or filename is None:
+            return None
+        profile.disable()
+        profile.dump_stats(filename)
+        return filename
+
+    def stats(self):
+        '''
+        Get a list of (kind, name, event_type, calls, total, max) tuples,
+        times in seconds, slowest total first.
+        '''
+        with self.__lock:
+            rows = [key + tuple(value) for key, value in self.__stats.items()]
+        rows.sort(key=lambda row: row[4], reverse=True)
+        return rows
+
+    def report(self, top=10):
+        '''Get the top handlers by total time as lines of text.'''
+        rows = self.stats()[:top]
+        if not rows:
+            return ['No handlers profiled']
+        template = '%-8s %-24s %-16s %7s %10s %9s'
+        lines = [template % ('kind', 'handler', 'event', 'calls',
+                             'total ms', 'max ms')]
+        for kind, name, event_type, calls, total, max_ in rows:
+            lines.append(template % (kind, name, event_type, calls,
+                                     '%.2f' % (total * 1000),
+                                     '%.2f' % (max_ * 1000)))
+        return lines
+
+profiler = HandlerProfiler()
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
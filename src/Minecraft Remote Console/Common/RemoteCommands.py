@@ -1,46 +1,24 @@
 #!/usr/bin/python
-import json
-from threading import Thread
 
 import wx
 
 from Common.Commands import CommandCategory, Command
 from Common import Events
 from Common.MinecraftApi import MinecraftJsonApi
+from Common.Rendering import Pager
+from Common.Scheduler import CallScheduler
+from Common.Subscriptions import SubscriptionManager
 
-class ConsoleListener(Thread):
-    def __init__(self, input_, controler_, filter_=None):
-        Thread.__init__(self)
-        self.__input = input_
-        self.__controler = controler_
-        self.__filter = filter_ if filter_ else lambda x: True
-        self.active = True
-        self.daemon = True
-
-    def run(self):
-        ctrl = self.__controler
-        try:
-            while self.active:
-                raw = self.__input.readline()
-                res = json.loads(raw.decode())
-                line = res[res['result']]['line']
-                if self.__filter(line) and self.active:
-                    evt = Events.OutputEvent(data=line)
-                    ctrl.trigger_event(evt)
-        except Exception as e:
-            evt = Events.OutputEvent(data='ERROR')
-            evt.add_output('Error: %s' % e)
-            ctrl.trigger_event(evt)
-            raise
-        finally:
-            self.__input.close()
+FEEDS = ['console', 'chat', 'connections']
 
 class RemoteCommands(object):
     def __init__(self, controler):
         self.__controler = controler
         self.__datastore = controler.get_datastore('Remote Commands')
         self.__server = None
-        self.__subscription = None
+        self.__scheduler = None
+        self.__pager = None
+        self.__subscriptions = SubscriptionManager(controler)
    
     #region: Connection Events
     def __on_connect(self):
@@ -48,16 +26,23 @@ class RemoteCommands(object):
             args = list(event.args)
             args[0] = args[0][1:] # trim prefix character
             try:
-                rval = self.__server.call(*args)
+                rval = self.__scheduler.call(*args)
                 if rval:
-                    event.add_output(json.dumps(rval, indent=2))
+                    self.__pager = Pager(rval, self.__page_lines(event))
+                    self.__show_page(event)
             except Exception as e:
                 event.add_output('Error: %s' % e)
             event.is_handled = True
 
         def on_connect(event):
             '''Perform setup when connecting to a server'''
+            if self.__scheduler != None:
+                self.__scheduler.close()
+            if self.__server != None and self.__server is not event.data:
+                # release the pooled connections of the previous server
+                self.__server.close()
             self.__server = event.data
+            self.__scheduler = CallScheduler(self.__server)
 
             cmds = []
             letters = list('abcdefghijklmnopqrstuvwxyz')
@@ -81,13 +66,20 @@ class RemoteCommands(object):
             for cmd in cmds:
                 self.__category.add_command(cmd)
             self.__category.add_builtins()
+            self.__category.add_command(self.__more())
             self.__controler.set_default_handler(self.__do_console())
             event.is_handled = True
         return Command(on_connect, events=[Events.Event.TYPE_CONNECT])
    
     def __on_disconnect(self):
         def on_disconnect(event):
+            if self.__scheduler != None:
+                self.__scheduler.close()
+            if self.__server != None:
+                self.__server.close()
+            self.__scheduler = None
             self.__server = None
+            self.__pager = None
             self.__category.clear_commands()
             self.__category.add_builtins()
             self.__controler.set_default_handler(self.__noop())
@@ -96,26 +88,48 @@ class RemoteCommands(object):
     
     def __subscribe(self):
         def subscribe(event):
-            if self.__subscription != None:
-                self.__subscription.active = False
-            feed = event.data.subscribe('console')
-            sub = ConsoleListener(feed, self.__controler)
-            self.__subscription = sub
-            sub.start()
+            for feed in FEEDS:
+                self.__subscriptions.subscribe(event.data, feed)
             event.is_handled = True
         return Command(subscribe, events=[Events.Event.TYPE_CONNECT])
 
     def __unsubscribe(self):
         def unsubscribe(event):
-            if self.__subscription != None:
-                self.__subscription.active = False
-            self.__subscription = None
+            self.__subscriptions.unsubscribe()
             event.is_handled = True
         return Command(unsubscribe, events=[Events.Event.TYPE_DISCONNECT])
 
     #endregion: Connection Events
 
     #region: Input Events
+    def __page_lines(self, event):
+        try:
+            return max(1, int(event.env.get('page_lines', 200)))
+        except ValueError:
+            return 200
+
+    def __show_page(self, event):
+        event.add_output(self.__pager.next_page())
+        if self.__pager.has_more():
+            event.add_output('-- More: type %smore to continue --' 
+                             % self.__category.prefix)
+        else:
+            self.__pager = None
+
+    def __more(self):
+        def more(event):
+            '''Show the next page of the last result'''
+            if self.__pager == None:
+                event.add_output('Nothing more to show')
+            else:
+                self.__show_page(event)
+            event.is_handled = True
+        return Command(more, 
+                environment=[
+                    ('page_lines', 'Lines of output per page (200)')
+                ],
+                events=[Events.Event.TYPE_INPUT])
+
     #endregion: Input Events
     
     #region: Default Handlers
@@ -130,11 +144,13 @@ class RemoteCommands(object):
                     and self.__server != None):
                 if event.data[0] == '/':
                     #console command
-                    self.__server.call('runConsoleCommand', event.data[1:])
+                    self.__scheduler.call('runConsoleCommand', 
+                                          event.data[1:])
                 else:
                     #chat
                     name = event.env.get('name', 'Megatron')
-                    self.__server.call('broadcastWithName', event.data, name)
+                    self.__scheduler.call('broadcastWithName', 
+                                          event.data, name)
         return handler           
                 
     #endregion: Default Handlers
@@ -148,4 +164,12 @@ class RemoteCommands(object):
         category.add_command(self.__subscribe())
         category.add_command(self.__unsubscribe())
         return category
+
+    def get_scheduler(self):
+        '''Get the call scheduler for the connected server, or None.
+
+        Scripts should submit bulk work with CallScheduler.BATCH priority so
+        that interactive input is sent first.
+        '''
+        return self.__scheduler
 # vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
@@ -0,0 +1,222 @@
+#!/usr/bin/python
+import json
+from collections import deque
+from threading import Lock
+from time import time
+
+class Pager(object):
+    '''Render a call result a page at a time.
+
+    JSON values are pretty printed with an iterative encoder so only the
+    part of the value needed for the current page is rendered. Strings,
+    such as file contents, are paged by their own lines. Lines longer than
+    max_line_length are truncated.
+    '''
+    def __init__(self, value, page_lines=200, max_line_length=2000):
+        self.page_lines = page_lines
+        self.max_line_length = max_line_length
+        self.__lines = deque()
+        self.__partial = u''
+        if isinstance(value, basestring):
+            self.__chunks = iter(value.splitlines(True))
+        else:
+            self.__chunks = json.JSONEncoder(indent=2).iterencode(value)
+
+    def __fill(self):
+        '''Render chunks until a page worth of lines is ready.'''
+        while len(self.__lines) < self.page_lines:
+            try:
+                chunk = next(self.__chunks)
+            except StopIteration:
+                if self.__partial:
+                    self.__lines.append(self.__partial)
+                    self.__partial = u''
+                return
+            lines = (self.__partial + chunk).split(u'\n')
+            self.__partial = lines.pop()
+            self.__lines.extend(lines)
+
+    def __trim(self, line):
+        if len(line) > self.max_line_length:
+            return u'%s... (%d more characters)' % (
+                line[:self.max_line_length],
+                len(line) - self.max_line_length)
+        return line
+
+    def next_page(self):
+        '''Get the next page of output as a single string.'''
+        self.__fill()
+        count = min(self.page_lines, len(self.__lines))
+        page = [self.__trim(self.__lines.popleft()) for i in xrange(count)]
+        return u'\n'.join(page)
+
+    def has_more(self):
+        '''Check whether any output remains after the current page.'''
+        self.__fill()
+        return len(self.__lines) > 0
+
+class OutputCoalescer(object):
+    '''Collect output from any thread and display it in batches.
+
+    schedule(delay, callback) must run callback on the GUI thread after
+    delay seconds. At most one flush is scheduled at a time and flushes are
+    at least interval seconds apart, so a burst of output is displayed once
+    per frame rather than once per event. flush(text, input, scroll) is
+    called with every pending line joined in the order added, the last
+    input text set (or None), and whether any output asked to scroll.
+    '''
+    def __init__(self, schedule, flush, interval=0.04):
+        self.interval = interval
+        self.flushes = 0
+        self.lines = 0
+        self.__schedule = schedule
+        self.__flush = flush
+        self.__lock = Lock()
+        self.__pending = []
+        self.__input = None
+        self.__scroll = False
+        self.__scheduled = False
+        self.__last = 0.0
+
+    def add(self, lines, input=None, scroll=False):
+        '''Queue lines of output, and optionally new input text.
+
+        Nothing is scheduled when there is nothing to display.
+        '''
+        if not lines and input is None and not scroll:
+            return
+        with self.__lock:
+            for line in lines:
+                line = unicode(line)
+                if not line.endswith(u'\n'):
+                    line += u'\n'
+                self.__pending.append(line)
+            if input is not None:
+                self.__input = input
+            self.__scroll = self.__scroll or scroll
+            if self.__scheduled:
+                return
+            self.__scheduled = True
+            delay = max(0.0, self.__last + self.interval - time())
+        self.__schedule(delay, self.__run)
+
+    def discard(self):
+        '''Forget output that has not been displayed yet.'''
+        with self.__lock:
+            self.__pending = []
+            self.__scroll = False
+
+    def __run(self):
+        with self.__lock:
+            pending, self.__pending = self.__pending, []
+            input, self.__input = self.__input, None
+            scroll, self.__scroll = self.__scroll, False
+            self.__scheduled = False
+            self.__last = time()
+            self.flushes += 1
+            self.lines += len(pending)
+        self.__flush(u''.join(pending), input, scroll)
+
+class Scrollback(object):
+    '''Bounded record of the text shown in the output pane.
+
+    Holds the length of every displayed line in a ring buffer, limited to
+    max_lines lines and max_bytes UTF-8 bytes (None for no limit). Once a
+    limit is passed the oldest lines are trimmed in one go, down to
+    1 - chunk of the limit, so the pane is cut rarely and in large pieces.
+    Every line is also appended to the file at history_path, if given, so
+    the full history outlives the trimming; the file is flushed after every
+    batch so a crash loses nothing already displayed.
+    '''
+    def __init__(self, max_lines=10000, max_bytes=None, chunk=0.1,
+            history_path=None):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.chunk = chunk
+        self.history_path = history_path
+        self.trimmed = 0
+        self.__lines = deque()
+        self.__chars = 0
+        self.__newlines = 0
+        self.__bytes = 0
+        self.__history = None
+
+    def __over(self, slack):
+        return ((self.max_lines is not None and
+                 len(self.__lines) > self.max_lines * slack) or
+                (self.max_bytes is not None and
+                 self.__bytes > self.max_bytes * slack))
+
+    def __spill(self, data):
+        if self.history_path is None:
+            return
+        try:
+            if self.__history is None:
+                self.__history = open(self.history_path, 'ab')
+            self.__history.write(data)
+            self.__history.flush()
+        except IOError as e:
+            print('Scrollback history disabled: %s' % e)
+            self.history_path = None
+
+    def append(self, text, last_position=None):
+        '''Record text appended to the pane.
+
+        last_position is the pane's last position once text is appended.
+        Some platforms, such as Windows, count a newline as two positions,
+        so it is needed to find where the kept lines start; without it
+        every character is taken to be one position.
+
+        Return the number of positions to remove from the start of the
+        pane, 0 if it is within its limits.
+        '''
+        data = text.encode('utf-8')
+        self.__spill(data)
+        for line in text.splitlines(True):
+            size = len(line.encode('utf-8'))
+            newline = line[-1] in u'\r\n'
+            self.__lines.append((len(line), size, newline))
+            self.__chars += len(line)
+            self.__newlines += newline
+            self.__bytes += size
+        if not self.__over(1):
+            return 0
+        if last_position is not None and self.__newlines:
+            extra = max(0, (last_position - self.__chars) // self.__newlines)
+        else:
+            extra = 0
+        trim = 0
+        while self.__lines and self.__over(1 - self.chunk):
+            chars, size, newline = self.__lines.popleft()
+            self.__chars -= chars
+            self.__newlines -= newline
+            self.__bytes -= size
+            self.trimmed += chars
+            trim += chars
+            if newline:
+                trim += extra
+        return trim
+
+    def clear(self):
+        '''Forget the lines on display, the history file is kept.'''
+        self.__lines.clear()
+        self.__chars = 0
+        self.__newlines = 0
+        self.__bytes = 0
+
+    def stats(self):
+        return {
+            'lines': len(self.__lines),
+            'characters': self.__chars,
+            'bytes': self.__bytes,
+            'trimmed': self.trimmed,
+            'history_path': self.history_path,
+        }
+
+    def close(self):
+        '''Flush and close the history file.'''
+        history, self.__history = self.__history, None
+        if history is not None:
+            history.close()
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+from threading import Event, Lock
+
+class AsyncResult(object):
+    '''
+    Result of an asynchronous operation, filled in by another thread.
+
+    Used for calls driven by an event loop as well as for queued events
+    and scheduled calls. Callbacks added with add_callback are called with
+    the AsyncResult once it completes, on the thread that completed it.
+    '''
+    def __init__(self):
+        self.value = None
+        self.error = None
+        self.__done = Event()
+        self.__lock = Lock()
+        self.__callbacks = []
+
+    @staticmethod
+    def gather(results):
+        '''
+        Combine several AsyncResults into one.
+
+        The combined value is a list in the same order as results, where an
+        entry that failed holds its Exception rather than a value.
+        '''
+        combined = AsyncResult()
+        values = [None for r in results]
+        pending = [len(results)]
+        lock = Lock()
+        def collect(index):
+            def finish(result):
+                values[index] = (result.error if result.error is not None
+                                 else result.value)
+                with lock:
+                    pending[0] -= 1
+                    complete = pending[0] == 0
+                if complete:
+                    combined.set_result(values)
+            return finish
+        if not results:
+            combined.set_result(values)
+        for index, result in enumerate(results):
+            result.add_callback(collect(index))
+        return combined
+
+    def __finish(self, value, error):
+        with self.__lock:
+            if self.__done.is_set():
+                return
+            self.value = value
+            self.error = error
+            self.__done.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def set_result(self, value):
+        self.__finish(value, None)
+
+    def set_error(self, error):
+        self.__finish(None, error)
+
+    def done(self):
+        return self.__done.is_set()
+
+    def add_callback(self, callback):
+        '''
+        Call callback with this result once it completes.
+        '''
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def then(self, transform):
+        '''
+        Return a new AsyncResult holding transform(value).
+
+        Errors, including those raised by transform, are passed along.
+        '''
+        chained = AsyncResult()
+        def finish(result):
+            if result.error is not None:
+                chained.set_error(result.error)
+                return
+            try:
+                chained.set_result(transform(result.value))
+            except Exception as e:
+                chained.set_error(e)
+        self.add_callback(finish)
+        return chained
+
+    def wait(self, timeout=None):
+        '''
+        Block until the result is available and return it.
+
+        Only useful when the result is filled in on another thread.
+        '''
+        self.__done.wait(timeout)
+        if not self.__done.is_set():
+            raise Exception('Timed out waiting for result')
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
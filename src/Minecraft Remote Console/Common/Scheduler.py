@@ -0,0 +1,210 @@
+#!/usr/bin/python
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import sleep, time
+
+from Common.Results import AsyncResult
+
+class TokenBucket(object):
+    '''
+    Token bucket allowing rate operations per second with bursts of up to
+    burst operations.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__stamp = time()
+        self.__lock = Lock()
+
+    def take(self):
+        '''
+        Take a token if one is available.
+
+        Return 0 if a token was taken, otherwise the number of seconds
+        until one will be.
+        '''
+        with self.__lock:
+            now = time()
+            self.__tokens = min(self.burst,
+                self.__tokens + (now - self.__stamp) * self.rate)
+            self.__stamp = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return 0
+            return (1 - self.__tokens) / self.rate
+
+    def refund(self):
+        '''
+        Return a token that was taken but not used.
+        '''
+        with self.__lock:
+            self.__tokens = min(self.burst, self.__tokens + 1)
+
+class CallScheduler(object):
+    '''
+    Rate limited, prioritised queue of calls to a single server.
+
+    Calls wait in one lane per priority, lower numbers first, so
+    interactive input is sent ahead of any queued batch work. Calls leave
+    the queue no faster than the token bucket allows, protecting the
+    server tick rate. The queue holds at most max_queue calls; submitting
+    to a full queue raises.
+
+    call waits at most the server's socket_timeout (DEFAULT_TIMEOUT when it
+    has none) plus TIMEOUT_SLACK seconds, so a hung request cannot block
+    its caller, typically the event dispatcher, indefinitely. A call that
+    times out while still queued is removed and never sent.
+    '''
+    INTERACTIVE = 0
+    BATCH = 1
+    LANES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+    DEFAULT_TIMEOUT = 30
+    TIMEOUT_SLACK = 5
+
+    def __init__(self, server, rate=20, burst=10, max_queue=1000, workers=2):
+        self.server = server
+        self.max_queue = max_queue
+        self.__bucket = TokenBucket(rate, burst)
+        self.__lanes = dict([(p, deque()) for p in self.LANES])
+        self.__cond = Condition()
+        self.__running = True
+        self.__stats = dict([(p, {
+            'dispatched': 0,
+            'rejected': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }) for p in self.LANES])
+        self.__workers = [Thread(target=self.__work) for i in xrange(workers)]
+        for worker in self.__workers:
+            worker.daemon = True
+            worker.start()
+
+    def __depth(self):
+        return sum([len(lane) for lane in self.__lanes.values()])
+
+    def __next(self):
+        for priority in sorted(self.__lanes.keys()):
+            if self.__lanes[priority]:
+                return priority, self.__lanes[priority].popleft()
+        return None, None
+
+    def __work(self):
+        while True:
+            with self.__cond:
+                while self.__running and not self.__depth():
+                    self.__cond.wait()
+                if not self.__running:
+                    return
+            wait = self.__bucket.take()
+            if wait:
+                sleep(wait)
+                continue
+            with self.__cond:
+                priority, item = self.__next()
+                if item is not None:
+                    waited = time() - item[3]
+                    stats = self.__stats[priority]
+                    stats['dispatched'] += 1
+                    stats['wait_total'] += waited
+                    stats['wait_max'] = max(stats['wait_max'], waited)
+            if item is None:
+                self.__bucket.refund()
+                continue
+            method, args, result, queued = item
+            try:
+                result.set_result(self.server.call(method, *args))
+            except Exception as e:
+                result.set_error(e)
+
+    def submit(self, method, args=(), priority=BATCH):
+        '''
+        Queue a call, returning an AsyncResult for its value.
+        '''
+        result = AsyncResult()
+        with self.__cond:
+            if not self.__running:
+                raise Exception('Scheduler is closed')
+            if self.__depth() >= self.max_queue:
+                self.__stats[priority]['rejected'] += 1
+                raise Exception('Call queue full (%d calls)' % self.max_queue)
+            self.__lanes[priority].append((method, args, result, time()))
+            self.__cond.notify()
+        return result
+
+    def call(self, method, *args, **kwargs):
+        '''
+        Queue a call and wait for its result.
+
+        Accepts priority as a keyword argument, defaulting to INTERACTIVE,
+        and timeout, the seconds to wait before raising, defaulting to
+        call_timeout().
+        '''
+        priority = kwargs.get('priority', self.INTERACTIVE)
+        timeout = kwargs.get('timeout', self.call_timeout())
+        result = self.submit(method, args, priority)
+        try:
+            return result.wait(timeout)
+        except Exception:
+            if result.done():
+                raise
+        if self.__cancel(result):
+            raise Exception('%s timed out after %s seconds in the queue, '
+                            'not sent' % (method, timeout))
+        raise Exception('%s timed out after %s seconds' % (method, timeout))
+
+    def __cancel(self, result):
+        '''
+        Remove the queued call for result, returning False if it has
+        already been dispatched.
+        '''
+        with self.__cond:
+            for lane in self.__lanes.values():
+                queued = [item for item in lane if item[2] is result]
+                if queued:
+                    lane.remove(queued[0])
+                    break
+            else:
+                return False
+        result.set_error(Exception('Call cancelled'))
+        return True
+
+    def call_timeout(self):
+        '''
+        Get the seconds call waits for a result by default.
+        '''
+        timeout = getattr(self.server, 'socket_timeout', None)
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUT
+        return timeout + self.TIMEOUT_SLACK
+
+    def stats(self):
+        '''
+        Get queue depth and wait time statistics for every lane.
+        '''
+        with self.__cond:
+            lanes = {}
+            for priority, name in self.LANES.items():
+                stats = dict(self.__stats[priority])
+                dispatched = stats['dispatched']
+                stats['depth'] = len(self.__lanes[priority])
+                stats['wait_avg'] = (stats['wait_total'] / dispatched
+                                     if dispatched else 0.0)
+                lanes[name] = stats
+            return lanes
+
+    def close(self):
+        '''
+        Stop dispatching and fail every call still queued.
+        '''
+        with self.__cond:
+            self.__running = False
+            pending = []
+            for lane in self.__lanes.values():
+                pending.extend(lane)
+                lane.clear()
+            self.__cond.notify_all()
+        for method, args, result, queued in pending:
+            result.set_error(Exception('Scheduler closed'))
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
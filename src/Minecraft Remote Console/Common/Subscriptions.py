@@ -0,0 +1,192 @@
+#!/usr/bin/python
+import asyncore
+import random
+from collections import deque
+from threading import Thread
+from time import sleep, time
+
+from Common import Events
+from Common.AsyncMinecraftApi import AsyncSubscription
+
+def console_event(message):
+    return Events.OutputEvent(data=message['line'])
+
+def chat_event(message):
+    return Events.ChatEvent(data=message.get('message', ''),
+                            player=message.get('player', ''))
+
+def connection_event(message):
+    return Events.PlayerConnectionEvent(data=message.get('player', ''),
+                                        action=message.get('action', ''))
+
+class SubscriptionManager(object):
+    '''
+    Reads every subscribed JSONAPI feed on a single thread.
+
+    All feed sockets share one socket map that is polled with select by a
+    single reader thread. Each decoded message is turned into the event
+    type registered for its feed in FEED_EVENTS and posted to the
+    controler. Subscribing and unsubscribing are handed to the reader
+    thread so sockets are never closed while it is polling them.
+
+    A feed that drops is reopened by the reader thread with exponential
+    backoff and jitter, between min_delay and max_delay seconds. The
+    outage lasts until the first message arrives on a reopened feed, when
+    a single ReconnectEvent reports its full length and the backoff is
+    reset; connections the server drops before sending anything are part
+    of the same outage.
+    '''
+    FEED_EVENTS = {
+        'console': console_event,
+        'chat': chat_event,
+        'connections': connection_event,
+    }
+
+    def __init__(self, controler, timeout=0.05, min_delay=0.5,
+            max_delay=60):
+        self.__controler = controler
+        self.__timeout = timeout
+        self.__min_delay = min_delay
+        self.__max_delay = max_delay
+        self.__map = {}
+        self.__subscriptions = {}
+        self.__servers = {}
+        self.__outages = {}
+        self.__retries = {}
+        self.__pending = deque()
+        self.__thread = None
+
+    def __run(self):
+        while self.__thread is not None:
+            while self.__pending:
+                self.__pending.popleft()()
+            now = time()
+            for feed, due in self.__retries.items():
+                if due <= now:
+                    del self.__retries[feed]
+                    self.__open(feed)
+            if self.__map:
+                asyncore.loop(self.__timeout, map=self.__map, count=1)
+            else:
+                sleep(self.__timeout)
+
+    def __start(self):
+        if self.__thread is None:
+            self.__thread = Thread(target=self.__run)
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def __on_message(self, feed):
+        make_event = self.FEED_EVENTS[feed]
+        def on_message(message):
+            ctrl = self.__controler
+            try:
+                evt = make_event(message[message['result']])
+            except Exception as e:
+                evt = Events.OutputEvent(data='ERROR')
+                evt.add_output('Error: %s' % e)
+            ctrl.post_event(evt)
+        return on_message
+
+    def __on_open(self, feed):
+        def on_open():
+            # Data is flowing again, so the outage is over and the next
+            # drop starts a new backoff
+            started, attempt = self.__outages.pop(feed, (None, 0))
+            if started is not None:
+                evt = Events.ReconnectEvent(feed, time() - started)
+                self.__controler.post_event(evt)
+        return on_open
+
+    def __on_close(self, feed, subscription):
+        def on_close(error):
+            if self.__subscriptions.get(feed) is not subscription[0]:
+                return
+            del self.__subscriptions[feed]
+            self.__retry(feed, error)
+        return on_close
+
+    def __retry(self, feed, error):
+        '''
+        Schedule the next attempt at reopening feed.
+        '''
+        if feed not in self.__servers:
+            return
+        started, attempt = self.__outages.get(feed, (None, 0))
+        if started is None:
+            started = time()
+        self.__outages[feed] = (started, attempt + 1)
+        delay = min(self.__max_delay, self.__min_delay * 2 ** attempt)
+        delay *= random.uniform(0.5, 1.0)
+        self.__retries[feed] = time() + delay
+        if attempt == 0:
+            evt = Events.OutputEvent(data='ERROR')
+            if error is not None:
+                evt.add_output('Error: %s' % error)
+            evt.add_output('Subscription to %s lost, reconnecting' % feed)
+            self.__controler.post_event(evt)
+
+    def __open(self, feed):
+        '''
+        Open feed on its server. Only called from the reader thread.
+        '''
+        server = self.__servers[feed]
+        holder = [None]
+        try:
+            holder[0] = AsyncSubscription(server.host, server.port + 1,
+                server._createStreamURL(feed), self.__on_message(feed),
+                self.__map, self.__on_close(feed, holder),
+                self.__on_open(feed), server.stream_compression,
+                server.metrics, 'feed:%s' % feed)
+        except Exception as e:
+            self.__retry(feed, e)
+            return
+        self.__subscriptions[feed] = holder[0]
+
+    def __close(self, feed):
+        self.__servers.pop(feed, None)
+        self.__outages.pop(feed, None)
+        self.__retries.pop(feed, None)
+        subscription = self.__subscriptions.pop(feed, None)
+        if subscription is not None:
+            subscription.close()
+
+    def subscribe(self, server, feed):
+        '''
+        Subscribe to feed on server, replacing any existing subscription.
+        '''
+        if feed not in self.FEED_EVENTS:
+            raise NotImplementedError(
+                'Subscribing to feed \'%s\' is not supported.' % feed)
+        def open_feed():
+            self.__close(feed)
+            self.__servers[feed] = server
+            self.__open(feed)
+        self.__pending.append(open_feed)
+        self.__start()
+
+    def unsubscribe(self, feed=None):
+        '''
+        Close the subscription to feed, or to every feed if None.
+        '''
+        feeds = [feed] if feed is not None else self.FEED_EVENTS.keys()
+        for name in feeds:
+            self.__pending.append(lambda name=name: self.__close(name))
+
+    def transfer_stats(self):
+        '''
+        Get bytes received and decoded, summed over the open feeds.
+        '''
+        totals = {'bytes_received': 0, 'bytes_decoded': 0}
+        for subscription in self.__subscriptions.values():
+            for key, value in subscription.transfer_stats().items():
+                totals[key] += value
+        return totals
+
+    def feeds(self):
+        '''
+        Get the names of the currently subscribed feeds.
+        '''
+        return self.__subscriptions.keys()
+
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
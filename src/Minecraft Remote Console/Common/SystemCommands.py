@@ -1,5 +1,6 @@
 #!/usr/bin/python
 import csv
+import json
 from StringIO import StringIO
 
 import wx
@@ -7,6 +8,7 @@ import wx
 from Common.Commands import CommandCategory, Command
 from Common.Events import *
 from Common.MinecraftApi import MinecraftJsonApi
+from Common.Profiling import profiler
 
 ALIAS_STORE = 'aliases'
 HISTORY_STORE = 'history'
@@ -222,6 +224,8 @@ class SystemCommands(object):
             ('username', str, None, None, 'admin'),
             ('password', str, None, None, 'demo'),
             ('salt', str, None, None, ''),
+            ('socket_timeout', float, lambda x: x > 0,
+                'socket_timeout must be greater than 0', 30),
         ]
         def connect(event):
             '''Connect to remote Minecraft server
@@ -264,7 +268,9 @@ class SystemCommands(object):
                         ('remote_port', 'Override default port (20079)'),
                         ('remote_username', 'Override default user (admin)'),
                         ('remote_password', 'Override default password (demo)'),
-                        ('remote_salt', 'Override default salt ()')
+                        ('remote_salt', 'Override default salt ()'),
+                        ('remote_socket_timeout',
+                            'Override default call timeout in seconds (30)')
                     ],
                     events=[Event.TYPE_INPUT])
 
@@ -273,8 +279,9 @@ class SystemCommands(object):
             '''Disconnect from remote Minecraft server
             '''
             if self.__server:
-                evt = Events.DisconnectEvent(data=self.__server)
+                evt = DisconnectEvent(data=self.__server)
                 event.add_triggered_event(evt)
+                self.__server = None
             event.is_handled = True
         return Command(disconnect, events=[Event.TYPE_INPUT])
 
@@ -300,6 +307,100 @@ class SystemCommands(object):
             event.is_handled = True
         return Command(load, events=[Event.TYPE_INPUT])
 
+    def __stats(self):
+        def stats(event):
+            '''Show call and feed latency statistics
+
+            Latencies are in milliseconds, per method and per phase: sign,
+            connect, wait, decode and total. Event queue and event chain
+            statistics are shown first. Give a file name to also export the
+            statistics as JSON.
+            '''
+            lanes = self.__controler.get_event_stats()
+            for name in sorted(lanes.keys()):
+                event.add_output('Event queue %s: %d/%d queued (max %d), '
+                    '%d posted, %d dropped, %d blocked for %.2fs (%s)' % (
+                    name, lanes[name]['depth'], lanes[name]['max_size'],
+                    lanes[name]['max_depth'], lanes[name]['posted'],
+                    lanes[name]['dropped'], lanes[name]['blocked'],
+                    lanes[name]['blocked_time'], lanes[name]['policy']))
+            chains = self.__controler.get_chain_metrics()
+            for line in chains.report():
+                event.add_output(line)
+            if self.__server == None:
+                data = {}
+                event.add_output('Not connected')
+            else:
+                data = self.__server.getStats()
+                self.__show_stats(event, data)
+            data['events'] = lanes
+            data['chains'] = chains.snapshot()
+            if len(event.args) > 1:
+                try:
+                    with open(event.args[1], 'w') as f:
+                        json.dump(data, f, indent=2, sort_keys=True)
+                    event.add_output('Statistics exported to %s' %
+                                     event.args[1])
+                except Exception as e:
+                    event.add_output('Error: %s' % e)
+            event.is_handled = True
+        return Command(stats, 
+                parameters=['_file'],
+                events=[Event.TYPE_INPUT])
+
+    def __profile(self):
+        def profile(event):
+            '''Profile command handlers
+
+            "start" begins a capture, given a file name it also runs
+            cProfile and writes its stats there on "stop". "report" lists
+            the handlers that took the most time.
+            '''
+            def stop():
+                try:
+                    filename = profiler.stop()
+                except Exception as e:
+                    event.add_output('Error: cProfile stats not written - '
+                                     '%s' % e)
+                    return
+                if filename:
+                    event.add_output('cProfile stats written to %s' %
+                                     filename)
+            action = event.args[1]
+            if action == 'start':
+                filename = event.args[2] if len(event.args) > 2 else None
+                # finish the previous capture so its stats are reported
+                stop()
+                profiler.start(filename)
+                event.add_output('Profiling started')
+            elif action == 'stop':
+                event.add_output('Profiling stopped')
+                stop()
+            elif action == 'report':
+                for line in profiler.report():
+                    event.add_output(line)
+            else:
+                event.add_output('Unknown action "%s", use start, stop or '
+                                 'report' % action)
+            event.is_handled = True
+        return Command(profile,
+                parameters=['action', '_file'],
+                events=[Event.TYPE_INPUT])
+
+    def __show_stats(self, event, data):
+        '''Add the connected server's statistics to event'''
+        lines = self.__server.metrics.report()
+        for line in lines or ['No calls made yet']:
+            event.add_output(line)
+        event.add_output('Bytes received: %(bytes_received)d, '
+                         'decoded: %(bytes_decoded)d' % data['transfer'])
+        if 'coalescing' in data:
+            event.add_output('Coalesced calls: %(coalesced)d of '
+                             '%(calls)d' % data['coalescing'])
+        if 'result_cache' in data:
+            event.add_output('Result cache: %(hits)d hits, '
+                             '%(misses)d misses' % data['result_cache'])
+
     #endregion: Input Events
     
     def create_commands(self):
@@ -317,6 +418,8 @@ class SystemCommands(object):
         category.add_command(self.__disconnect())
         category.add_command(self.__save())
         category.add_command(self.__load())
+        category.add_command(self.__stats())
+        category.add_command(self.__profile())
         
         # KeyPress Events
         category.add_command(self.__onquit())
@@ -4,6 +4,7 @@ from Advanced.Window import AdvancedWindow
 from Advanced.Control import Control
 from Common.SystemCommands import SystemCommands
 from Common.RemoteCommands import RemoteCommands
+from Common.FleetCommands import FleetCommands
 
 if __name__ == '__main__':
     app = AdvancedWindow.start_app()
@@ -12,7 +13,9 @@ if __name__ == '__main__':
     controler = Control(window)
     sys = SystemCommands(controler)
     remote = RemoteCommands(controler)
+    fleet = FleetCommands(controler)
     controler.register_commands(sys.create_commands())
     controler.register_commands(remote.create_commands())
+    controler.register_commands(fleet.create_commands())
     app.MainLoop()
 # vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
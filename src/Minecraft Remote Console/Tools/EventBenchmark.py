@@ -0,0 +1,89 @@
+#!/usr/bin/python
+'''Measure the memory footprint and construction cost of events.
+
+The footprint of an event is the size of the event and of every container
+it owns, such as its attribute dictionary and output list. Objects shared
+between events, such as the data string and the environment assigned by
+the controler, are not counted.
+
+Usage:
+    python -m Tools.EventBenchmark [--count 100000]
+'''
+import sys
+from optparse import OptionParser
+from timeit import default_timer
+
+from Common import Events
+
+LINE = '[12:00:00] [Server thread/INFO]: Notch joined the game'
+
+def slot_names(obj):
+    '''Get the attribute names of every slot obj has.'''
+    for cls in type(obj).__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = [slots]
+        for name in slots:
+            if name.startswith('__') and not name.endswith('__'):
+                name = '_%s%s' % (cls.__name__.lstrip('_'), name)
+            yield name
+
+def footprint(event, shared=()):
+    '''Get the bytes owned by event, not counting the objects in shared.'''
+    seen = set([id(x) for x in shared])
+    size = 0
+    stack = [event]
+    while stack:
+        obj = stack.pop()
+        if obj is None or isinstance(obj, (bool, int, float)):
+            continue
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            # keys are interned attribute names shared by every instance
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, Events.Event):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for name in slot_names(obj):
+                stack.append(getattr(obj, name, None))
+    return size
+
+def parsed_input():
+    event = Events.InputEvent(LINE)
+    event.args
+    return event
+
+FACTORIES = [
+    ('OutputEvent', lambda: Events.OutputEvent(LINE)),
+    ('ChatEvent', lambda: Events.ChatEvent(LINE, 'Notch')),
+    ('InputEvent', lambda: Events.InputEvent(LINE)),
+    ('InputEvent + args', parsed_input),
+]
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--count', type='int', default=100000,
+        help='events built per timing run')
+    options, args = parser.parse_args(argv)
+    env = {}
+    shared = [LINE, 'Notch', '', (), env]
+    print('%-20s %10s %12s' % ('event', 'bytes', 'build us'))
+    for name, factory in FACTORIES:
+        event = factory()
+        event.env = env
+        size = footprint(event, shared)
+        start = default_timer()
+        for i in xrange(options.count):
+            factory()
+        elapsed = default_timer() - start
+        print('%-20s %10d %12.2f' % (name, size,
+                                     1e6 * elapsed / options.count))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+'''Drive the JSONAPI client against a server and report how it performs.
+
+Without --host a MockServer is started in process. Scenarios:
+    call    threads making blocking calls
+    batch   call_many with --batch calls per request
+    async   --concurrency calls in flight on the async client
+    stream  read the console feed for --duration seconds
+
+Usage:
+    python -m Tools.LoadGenerator call --threads 8 --calls 200
+'''
+import sys
+from optparse import OptionParser
+from threading import Lock, Thread
+from time import sleep, time
+
+from Common.AsyncMinecraftApi import AsyncMinecraftJsonApi
+from Common.MinecraftApi import MinecraftJsonApi
+from Common.Subscriptions import console_event
+from Tools.MockServer import MockJsonApi, MockServer
+
+def percentile(samples, fraction):
+    '''Get the value below which fraction of the sorted samples fall.'''
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+class LoadReport(object):
+    '''
+    Collects latency samples and errors from any number of threads.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.errors = 0
+        self.items = 0
+        self.started = time()
+        self.finished = None
+        self.__lock = Lock()
+
+    def record(self, latency, items=1, error=None):
+        with self.__lock:
+            self.samples.append(latency)
+            self.items += items
+            if error is not None:
+                self.errors += 1
+
+    def finish(self):
+        self.finished = time()
+
+    def summary(self):
+        elapsed = (self.finished or time()) - self.started
+        samples = sorted(self.samples)
+        lines = ['%s: %d requests, %d items, %d errors in %.2fs' % (
+                    self.name, len(samples), self.items, self.errors,
+                    elapsed)]
+        if elapsed > 0:
+            lines.append('  throughput: %.1f requests/s, %.1f items/s' % (
+                         len(samples) / elapsed, self.items / elapsed))
+        if samples:
+            lines.append('  latency ms: p50 %.2f  p95 %.2f  p99 %.2f  '
+                         'max %.2f' % tuple([1000 * x for x in [
+                             percentile(samples, 0.50),
+                             percentile(samples, 0.95),
+                             percentile(samples, 0.99),
+                             samples[-1]]]))
+        return '\n'.join(lines)
+
+def timed(report, func, items=1):
+    start = time()
+    try:
+        func()
+    except Exception as e:
+        report.record(time() - start, items, e)
+        return
+    report.record(time() - start, items)
+
+def run_calls(server, options):
+    report = LoadReport('call %s' % options.method)
+    def worker():
+        for i in xrange(options.calls):
+            timed(report, lambda: server.call(options.method))
+    threads = [Thread(target=worker) for i in xrange(options.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.finish()
+    return report
+
+def run_batch(server, options):
+    report = LoadReport('call_many %s x%d' % (options.method, options.batch))
+    calls = [(options.method, [])] * options.batch
+    def worker():
+        for i in xrange(options.calls):
+            timed(report, lambda: server.call_many(calls), options.batch)
+    threads = [Thread(target=worker) for i in xrange(options.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.finish()
+    return report
+
+def run_async(server, options):
+    report = LoadReport('call_async %s' % options.method)
+    total = options.calls * options.threads
+    state = {'sent': 0, 'done': 0}
+    lock = Lock()
+    def send():
+        with lock:
+            if state['sent'] >= total:
+                return
+            state['sent'] += 1
+        start = time()
+        def finish(result):
+            report.record(time() - start, 1, result.error)
+            with lock:
+                state['done'] += 1
+            send()
+        server.call_async(options.method).add_callback(finish)
+    for i in xrange(options.concurrency):
+        send()
+    while state['done'] < total:
+        server.run(count=1)
+    report.finish()
+    return report
+
+def run_stream(server, options):
+    report = LoadReport('stream console')
+    stream = server.subscribe('console')
+    deadline = time() + options.duration
+    while time() < deadline:
+        start = time()
+        messages = stream.readjson_batch()
+        if not messages:
+            break
+        for message in messages:
+            console_event(message.get('success', {}))
+        report.record(time() - start, len(messages))
+    stream.close()
+    report.finish()
+    stats = stream.transfer_stats()
+    report.name += ' (%d bytes received, %d decoded)' % (
+        stats['bytes_received'], stats['bytes_decoded'])
+    return report
+
+SCENARIOS = {
+    'call': run_calls,
+    'batch': run_batch,
+    'async': run_async,
+    'stream': run_stream,
+}
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options] ' + '|'.join(
+        sorted(SCENARIOS.keys())))
+    parser.add_option('--host', default=None,
+        help='server to load, a mock server is started if omitted')
+    parser.add_option('--port', type='int', default=20059)
+    parser.add_option('--username', default='admin')
+    parser.add_option('--password', default='demo')
+    parser.add_option('--salt', default='')
+    parser.add_option('--method', default='getPlayers')
+    parser.add_option('--threads', type='int', default=4)
+    parser.add_option('--calls', type='int', default=100,
+        help='calls per thread')
+    parser.add_option('--batch', type='int', default=10)
+    parser.add_option('--concurrency', type='int', default=16)
+    parser.add_option('--duration', type='float', default=5.0)
+    parser.add_option('--no-compression', action='store_false',
+        dest='compression', default=True)
+    parser.add_option('--stream-compression', action='store_true',
+        default=False)
+    parser.add_option('--latency', type='float', default=0.0,
+        help='mock server: seconds of delay added to every call')
+    parser.add_option('--files', type='int', default=4,
+        help='mock server: number of method definition files')
+    parser.add_option('--methods', type='int', default=25,
+        help='mock server: number of methods per definition file')
+    parser.add_option('--line-rate', type='float', default=1000.0,
+        help='mock server: console lines per second')
+    options, args = parser.parse_args(argv)
+    scenarios = args or ['call']
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario %s' % scenario)
+
+    mock = None
+    host, port = options.host, options.port
+    if host is None:
+        mock = MockServer(MockJsonApi(options.username, options.password,
+            options.salt, options.latency, options.files, options.methods,
+            options.line_rate), port=0).start()
+        host, port = mock.host, mock.port
+
+    start = time()
+    server = AsyncMinecraftJsonApi(host=host, port=port,
+        username=options.username, password=options.password,
+        salt=options.salt, method_cache=False, pool_size=options.threads,
+        coalesce=False, compression=options.compression,
+        stream_compression=options.stream_compression)
+    print('Loaded %d methods in %.2fs' % (len(server.getLoadedMethods()),
+                                          time() - start))
+    try:
+        for scenario in scenarios:
+            print(SCENARIOS[scenario](server, options).summary())
+    finally:
+        server.close()
+        if mock is not None:
+            mock.stop()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python
@@ -0,0 +1,294 @@
+#!/usr/bin/python
+'''Local stand-in for a Bukkit server running JSONAPI.
+
+Serves /api/call and /api/call-multiple over HTTP on port, and the
+subscription streams on port+1, checking keys the same way JSONAPI does.
+Latency, the size of the method catalogue and the console line rate are
+configurable, so the client can be measured without a real server.
+
+Usage:
+    python -m Tools.MockServer [--port 20059] [--latency 0.01] ...
+'''
+import gzip
+import json
+import random
+import socket
+import sys
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import StreamRequestHandler, TCPServer, ThreadingMixIn
+from StringIO import StringIO
+from hashlib import sha256
+from optparse import OptionParser
+from threading import Thread
+from time import sleep, time
+from urlparse import parse_qs, urlparse
+
+PLAYERS = ['Notch', 'jeb_', 'Dinnerbone', 'Grumm', 'Searge']
+
+# Definitions of the core methods answered by MockJsonApi.handlers
+CORE_METHODS = [
+    {'name': 'getPlugins', 'desc': 'List the plugins and their state',
+     'returns': ['Object[]', 'Plugins'], 'args': []},
+    {'name': 'getPlayers', 'desc': 'List the online players',
+     'returns': ['Player[]', 'Players'], 'args': []},
+    {'name': 'getPlayerLimit', 'desc': 'Get the player limit',
+     'returns': ['int', 'Player limit'], 'args': []},
+    {'name': 'runConsoleCommand', 'desc': 'Run a console command',
+     'returns': ['boolean', 'Success'], 'args': [['String', 'command']]},
+    {'name': 'broadcastWithName', 'desc': 'Broadcast a named message',
+     'returns': ['boolean', 'Success'],
+     'args': [['String', 'message'], ['String', 'name']]},
+]
+
+class MockJsonApi(object):
+    '''
+    State and method implementations of the mock server.
+    '''
+    def __init__(self, username='admin', password='demo', salt='',
+            latency=0.0, files=4, methods=25, line_rate=10.0):
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.latency = latency
+        self.line_rate = line_rate
+        self.calls = 0
+        self.catalogue = {'core.json': json.dumps({
+            'namespace': '',
+            'depends': [],
+            'methods': CORE_METHODS,
+        })}
+        self.plugins = [{'name': 'JSONAPI', 'enabled': True}]
+        for f in xrange(files):
+            namespace = 'plugin%d' % f if f else ''
+            if namespace:
+                self.plugins.append({'name': namespace, 'enabled': f % 4 != 3})
+            self.catalogue['methods%d.json' % f] = json.dumps({
+                'namespace': namespace,
+                'depends': [namespace] if namespace else [],
+                'methods': [{
+                    'name': 'getValue%d' % m,
+                    'desc': 'Mock method %d' % m,
+                    'returns': ['int', 'A number'],
+                    'args': [['String', 'name']],
+                } for m in xrange(methods)],
+            })
+        self.handlers = {
+            'getPluginFiles': lambda name: self.catalogue.keys(),
+            'getFileContents': lambda name: self.catalogue[name],
+            'getPlugins': lambda: self.plugins,
+            'getPlayers': lambda: [{'name': p} for p in PLAYERS],
+            'getPlayerLimit': lambda: 20,
+            'runConsoleCommand': lambda command: True,
+            'broadcastWithName': lambda message, name: True,
+        }
+
+    def key(self, method):
+        return sha256('{0}{1}{2}{3}'.format(self.username, method,
+            self.password, self.salt).encode()).hexdigest()
+
+    def call(self, method, args):
+        self.calls += 1
+        handler = self.handlers.get(method)
+        if handler is None and method.split('.')[-1].startswith('getValue'):
+            handler = lambda *a: len(method)
+        if handler is None:
+            return {'result': 'error',
+                    'error': 'The method \'%s\' does not exist!' % method}
+        try:
+            return {'result': 'success', 'source': method,
+                    'success': handler(*args)}
+        except Exception as e:
+            return {'result': 'error', 'error': str(e)}
+
+    def console_line(self, count):
+        return {'result': 'success', 'source': 'console',
+                'success': {'time': int(time()),
+                            'line': '[INFO] Mock console line %d' % count}}
+
+    def chat_line(self, count):
+        return {'result': 'success', 'source': 'chat',
+                'success': {'time': int(time()),
+                            'player': random.choice(PLAYERS),
+                            'message': 'Hello %d' % count}}
+
+    def connection_line(self, count):
+        return {'result': 'success', 'source': 'connections',
+                'success': {'time': int(time()),
+                            'player': random.choice(PLAYERS),
+                            'action': random.choice(['connected',
+                                                     'disconnected'])}}
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write rather than a packet per header
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def __reply(self, code, body):
+        body = json.dumps(body).encode()
+        encoding = None
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            stream = StringIO()
+            compressed = gzip.GzipFile(fileobj=stream, mode='wb')
+            compressed.write(body)
+            compressed.close()
+            body = stream.getvalue()
+            encoding = 'gzip'
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        query = dict([(k, v[0]) for k, v in parse_qs(url.query).items()])
+        if api.latency:
+            sleep(api.latency)
+        try:
+            method = query['method']
+            args = json.loads(query.get('args', '[]'))
+        except (KeyError, ValueError):
+            self.__reply(400, {'result': 'error', 'error': 'Bad request'})
+            return
+        if query.get('key') != api.key(method):
+            self.__reply(200, {'result': 'error',
+                               'error': 'Invalid API key'})
+            return
+        if url.path == '/api/call':
+            self.__reply(200, api.call(method, args))
+        elif url.path == '/api/call-multiple':
+            methods = json.loads(method)
+            self.__reply(200, {'result': 'success', 'source': methods,
+                'success': [api.call(m, a) for m, a in zip(methods, args)]})
+        else:
+            self.__reply(404, {'result': 'error', 'error': 'Not found'})
+
+class StreamHandler(StreamRequestHandler):
+    FEEDS = {
+        'console': MockJsonApi.console_line,
+        'chat': MockJsonApi.chat_line,
+        'connections': MockJsonApi.connection_line,
+    }
+
+    def handle(self):
+        api = self.server.api
+        url = urlparse(self.rfile.readline().strip())
+        query = dict([(k, v[0]) for k, v in parse_qs(url.query).items()])
+        source = query.get('source')
+        if source not in self.FEEDS or query.get('key') != api.key(source):
+            self.wfile.write(json.dumps({'result': 'error',
+                'error': 'Invalid API key'}) + '\n')
+            return
+        make_line = self.FEEDS[source]
+        compressor = None
+        if query.get('compression') == 'deflate':
+            compressor = zlib.compressobj()
+        # chat and connections are much quieter than the console
+        rate = api.line_rate if source == 'console' else api.line_rate / 10.0
+        count = 0
+        started = time()
+        try:
+            while True:
+                lines = []
+                due = int((time() - started) * rate) + 1
+                while count < due:
+                    lines.append(json.dumps(make_line(api, count)) + '\n')
+                    count += 1
+                data = ''.join(lines).encode()
+                if compressor is not None:
+                    data = (compressor.compress(data) +
+                            compressor.flush(zlib.Z_SYNC_FLUSH))
+                self.wfile.write(data)
+                self.wfile.flush()
+                sleep(min(0.05, 1.0 / rate) if rate > 0 else 1)
+        except socket.error:
+            pass
+
+    def finish(self):
+        # The client hanging up is how every subscription ends
+        try:
+            StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+class ThreadedTCPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+class MockServer(object):
+    '''
+    Runs the HTTP and stream servers for a MockJsonApi on background
+    threads. Use port 0 to pick a free pair of ports.
+    '''
+    def __init__(self, api, host='127.0.0.1', port=20059):
+        self.api = api
+        self.host = host
+        while True:
+            self.http = ThreadedHTTPServer((host, port), ApiHandler)
+            self.port = self.http.server_address[1]
+            try:
+                self.stream = ThreadedTCPServer((host, self.port + 1),
+                                                StreamHandler)
+                break
+            except socket.error:
+                self.http.server_close()
+                if port:
+                    raise
+        self.http.api = api
+        self.stream.api = api
+
+    def start(self):
+        for server in [self.http, self.stream]:
+            thread = Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        for server in [self.http, self.stream]:
+            server.shutdown()
+            server.server_close()
+
+def main(argv):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=20059)
+    parser.add_option('--username', default='admin')
+    parser.add_option('--password', default='demo')
+    parser.add_option('--salt', default='')
+    parser.add_option('--latency', type='float', default=0.0,
+        help='seconds of delay added to every call')
+    parser.add_option('--files', type='int', default=4,
+        help='number of method definition files')
+    parser.add_option('--methods', type='int', default=25,
+        help='number of methods per definition file')
+    parser.add_option('--line-rate', type='float', default=10.0,
+        help='console lines per second on each subscription')
+    options, args = parser.parse_args(argv)
+    api = MockJsonApi(options.username, options.password, options.salt,
+        options.latency, options.files, options.methods, options.line_rate)
+    server = MockServer(api, options.host, options.port).start()
+    print('Mock JSONAPI listening on %s:%d (streams on %d)' %
+          (server.host, server.port, server.port + 1))
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+# vim: shiftwidth=4:softtabstop=4:expandtab:autoindent:syntax=python